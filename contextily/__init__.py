@@ -2,13 +2,52 @@
 `contextily`: create context with map tiles in Python
 """
 
-import xyzservices.providers as providers
-from .place import Place
-from .tile import *
-from .plotting import add_basemap, add_attribution
-
+from importlib import import_module
 from importlib.metadata import PackageNotFoundError, version
 
+# The public API is loaded lazily on first attribute access (PEP 562), so that
+# `import contextily` does not import matplotlib, rasterio, geopy, etc. until
+# they are actually needed.
+_lazy_attributes = {
+    "Place": ".place",
+    "bounds2raster": ".tile",
+    "bounds2img": ".tile",
+    "warp_tiles": ".tile",
+    "warp_img_transform": ".tile",
+    "howmany": ".tile",
+    "estimate_download": ".tile",
+    "set_cache_dir": ".tile",
+    "add_basemap": ".plotting",
+    "add_attribution": ".plotting",
+    "BasemapArtist": ".plotting",
+    "TileStore": ".store",
+    "MemoryTileStore": ".store",
+    "FileTileStore": ".store",
+    "SQLiteTileStore": ".store",
+    "DecodedTileCache": ".store",
+}
+_submodules = {"archive", "place", "plotting", "server", "store", "tile"}
+
+__all__ = ["providers", *_lazy_attributes]
+
+
+def __getattr__(name):
+    if name == "providers":
+        import xyzservices.providers as value
+    elif name in _lazy_attributes:
+        value = getattr(import_module(_lazy_attributes[name], __name__), name)
+    elif name in _submodules:
+        value = import_module("." + name, __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *__all__, *_submodules})
+
+
 try:
     __version__ = version("contextily")
 except PackageNotFoundError:  # noqa
@@ -0,0 +1,71 @@
+"""Command line interface of contextily, e.g. ``python -m contextily serve``."""
+
+import argparse
+
+
+def _resolve_source(source):
+    """
+    Resolve a provider name (e.g. 'CartoDB.Positron') or URL to a source.
+    """
+    if source is None or "{" in source or source.lower().endswith(
+        (".mbtiles", ".pmtiles")
+    ):
+        return source
+    import xyzservices
+
+    try:
+        return xyzservices.providers.query_name(source)
+    except ValueError:
+        raise ValueError("Unknown tile provider {!r}".format(source))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m contextily")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser(
+        "serve", help="run a local caching proxy for a tile provider"
+    )
+    serve.add_argument(
+        "source",
+        nargs="?",
+        help="provider name (e.g. 'CartoDB.Positron') or tile URL, "
+        "OpenStreetMap Humanitarian by default",
+    )
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument(
+        "--cache-dir", help="directory of the tile cache, kept after exiting"
+    )
+    serve.add_argument(
+        "--max-rate",
+        type=float,
+        help="maximum number of requests per second sent to the provider",
+    )
+    serve.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help="maximum number of concurrent connections to the provider",
+    )
+    serve.add_argument("--timeout", type=float)
+    serve.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    from .server import serve as run_server
+    from .tile import set_cache_dir
+
+    if args.cache_dir is not None:
+        set_cache_dir(args.cache_dir)
+    run_server(
+        _resolve_source(args.source),
+        host=args.host,
+        port=args.port,
+        max_rate=args.max_rate,
+        n_connections=args.connections,
+        timeout=args.timeout,
+        verbose=args.verbose,
+    )
+
+
+if __name__ == "__main__":
+    main()
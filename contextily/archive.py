@@ -0,0 +1,354 @@
+"""Tools for reading tiles from single-file MBTiles and PMTiles archives."""
+
+import gzip
+import json
+import os
+import sqlite3
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from urllib.request import pathname2url
+
+import numpy as np
+
+ARCHIVE_EXTENSIONS = (".mbtiles", ".pmtiles")
+
+
+def _is_archive_path(source):
+    """
+    Check if `source` is the path to a tile archive (MBTiles or PMTiles).
+    """
+    return isinstance(source, str) and source.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(path):
+    """
+    Open a tile archive, reusing an already opened reader for the same file.
+
+    Parameters
+    ----------
+    path : str
+        Path to a ``.mbtiles`` or ``.pmtiles`` file.
+
+    Returns
+    -------
+    MBTiles or PMTiles
+        Reader for the archive.
+    """
+    path = os.path.abspath(path)
+    key = (path, os.stat(path).st_mtime_ns)
+    with _archives_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            if path.lower().endswith(".mbtiles"):
+                archive = MBTiles(path)
+            elif path.lower().endswith(".pmtiles"):
+                archive = PMTiles(path)
+            else:
+                raise ValueError(
+                    "Unknown tile archive format for {}. Supported extensions "
+                    "are {}".format(path, ", ".join(ARCHIVE_EXTENSIONS))
+                )
+            _archives[key] = archive
+    return archive
+
+
+class MBTiles(object):
+    """Read tiles from an MBTiles (SQLite) archive.
+
+    Parameters
+    ----------
+    path : str
+        Path to the ``.mbtiles`` file.
+
+    Attributes
+    ----------
+    metadata : dict
+        Content of the ``metadata`` table of the archive.
+    min_zoom : int or None
+        Minimum zoom level stored in the archive, if known.
+    max_zoom : int or None
+        Maximum zoom level stored in the archive, if known.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as con:
+            rows = con.execute("SELECT name, value FROM metadata").fetchall()
+            self.metadata = dict(rows)
+            zooms = con.execute(
+                "SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles"
+            ).fetchone()
+        self.min_zoom = int(self.metadata.get("minzoom", zooms[0] or 0))
+        max_zoom = self.metadata.get("maxzoom", zooms[1])
+        self.max_zoom = None if max_zoom is None else int(max_zoom)
+
+    def _connect(self):
+        # read-only, so that a missing file is not silently created. The
+        # connection is closed by the caller.
+        uri = "file:{}?mode=ro".format(pathname2url(self.path))
+        return sqlite3.connect(uri, uri=True)
+
+    def read_tiles(self, z, xs, ys):
+        """
+        Read the encoded content of a batch of tiles of a single zoom level.
+
+        Parameters
+        ----------
+        z : int
+            Zoom level of the tiles.
+        xs, ys : array_like of int
+            Column and row (XYZ scheme) of each tile.
+
+        Returns
+        -------
+        list of bytes or None
+            Encoded tile images, in the order of `xs` and `ys`. Tiles that
+            are not in the archive are None.
+        """
+        xs = np.asarray(xs)
+        # MBTiles stores rows in the TMS scheme, flipped with respect to XYZ
+        rows = (2**z - 1) - np.asarray(ys)
+        found = {}
+        with closing(self._connect()) as con:
+            # one indexed range query per column of the tile grid
+            for x in np.unique(xs):
+                col_rows = rows[xs == x]
+                found.update(
+                    ((x, row), data)
+                    for row, data in con.execute(
+                        "SELECT tile_row, tile_data FROM tiles WHERE zoom_level = ? "
+                        "AND tile_column = ? AND tile_row BETWEEN ? AND ?",
+                        (int(z), int(x), int(col_rows.min()), int(col_rows.max())),
+                    )
+                )
+        return [found.get((x, row)) for x, row in zip(xs.tolist(), rows.tolist())]
+
+
+# PMTiles v3, see https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md
+_PMTILES_HEADER = struct.Struct("<7sBQQQQQQQQQQQBBBBBBiiiiBii")
+_PMTILES_NONE, _PMTILES_GZIP = 1, 2
+# directory entries are resolved through at most three levels of leaves
+_PMTILES_MAX_DEPTH = 4
+
+
+def _zxy_to_tileid(z, x, y):
+    """
+    Convert a tile into its PMTiles tile ID (position along the Hilbert
+    curve, counted from the first tile of zoom level 0).
+    """
+    tile_id = ((1 << (2 * z)) - 1) // 3
+    n = 1 << z
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return tile_id
+
+
+def _read_varints(buffer, count, pos):
+    values = []
+    for _ in range(count):
+        value = shift = 0
+        while True:
+            byte = buffer[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append(value)
+    return values, pos
+
+
+def _deserialize_directory(buffer):
+    """
+    Decode a PMTiles directory into arrays of tile IDs, run lengths, offsets
+    and lengths, sorted by tile ID.
+    """
+    (n,), pos = _read_varints(buffer, 1, 0)
+    tile_ids, pos = _read_varints(buffer, n, pos)
+    run_lengths, pos = _read_varints(buffer, n, pos)
+    lengths, pos = _read_varints(buffer, n, pos)
+    raw_offsets, pos = _read_varints(buffer, n, pos)
+    offsets = []
+    for i, raw in enumerate(raw_offsets):
+        if raw == 0 and i > 0:
+            offsets.append(offsets[i - 1] + lengths[i - 1])
+        else:
+            offsets.append(raw - 1)
+    return (
+        np.cumsum(np.array(tile_ids, dtype=np.uint64)),
+        np.array(run_lengths, dtype=np.uint64),
+        np.array(offsets, dtype=np.uint64),
+        np.array(lengths, dtype=np.uint64),
+    )
+
+
+class PMTiles(object):
+    """Read tiles from a PMTiles (version 3) archive.
+
+    Directories are cached once read, so that looking up a batch of tiles
+    only reads the byte ranges of the tiles themselves.
+
+    Parameters
+    ----------
+    path : str
+        Path to the ``.pmtiles`` file.
+    max_cached_directories : int
+        [Optional. Default: 64] Number of leaf directories to keep in memory.
+
+    Attributes
+    ----------
+    metadata : dict
+        JSON metadata of the archive.
+    min_zoom : int
+        Minimum zoom level stored in the archive.
+    max_zoom : int
+        Maximum zoom level stored in the archive.
+    """
+
+    def __init__(self, path, max_cached_directories=64):
+        self.path = path
+        self.max_cached_directories = max_cached_directories
+        self._leaves = OrderedDict()
+        self._lock = threading.Lock()
+        with open(path, "rb") as f:
+            header = _PMTILES_HEADER.unpack(f.read(_PMTILES_HEADER.size))
+            if header[0] != b"PMTiles" or header[1] != 3:
+                raise ValueError(
+                    "{} is not a PMTiles version 3 archive".format(path)
+                )
+            (
+                root_offset,
+                root_length,
+                metadata_offset,
+                metadata_length,
+                self._leaves_offset,
+                _,
+                self._data_offset,
+            ) = header[2:9]
+            self._internal_compression = header[14]
+            self._tile_compression = header[15]
+            self.min_zoom, self.max_zoom = header[17], header[18]
+            self._root = _deserialize_directory(
+                self._read_compressed(f, root_offset, root_length)
+            )
+            metadata = self._read_compressed(f, metadata_offset, metadata_length)
+        self.metadata = json.loads(metadata) if metadata else {}
+
+    def _read_compressed(self, f, offset, length):
+        f.seek(offset)
+        return self._decompress(f.read(length), self._internal_compression)
+
+    @staticmethod
+    def _decompress(data, compression):
+        if compression == _PMTILES_GZIP:
+            return gzip.decompress(data)
+        if compression in (0, _PMTILES_NONE):
+            return data
+        raise ValueError(
+            "Unsupported PMTiles compression {}. Only gzip-compressed or "
+            "uncompressed archives are supported".format(compression)
+        )
+
+    def _leaf(self, f, offset, length):
+        key = (offset, length)
+        with self._lock:
+            if key in self._leaves:
+                self._leaves.move_to_end(key)
+                return self._leaves[key]
+        leaf = _deserialize_directory(
+            self._read_compressed(f, self._leaves_offset + offset, length)
+        )
+        with self._lock:
+            self._leaves[key] = leaf
+            while len(self._leaves) > self.max_cached_directories:
+                self._leaves.popitem(last=False)
+        return leaf
+
+    def _resolve(self, f, directory, tile_ids, out_offsets, out_lengths, idx, depth):
+        """
+        Find the byte ranges of `tile_ids` (positions `idx` of the output)
+        in `directory`, descending into leaf directories as needed.
+        """
+        if depth >= _PMTILES_MAX_DEPTH:
+            return
+        dir_ids, run_lengths, offsets, lengths = directory
+        k = np.searchsorted(dir_ids, tile_ids, side="right") - 1
+        valid = k >= 0
+        k, tile_ids, idx = k[valid], tile_ids[valid], idx[valid]
+        is_leaf = run_lengths[k] == 0
+        # tiles stored in this directory
+        in_run = ~is_leaf & (tile_ids - dir_ids[k] < run_lengths[k])
+        out_offsets[idx[in_run]] = offsets[k[in_run]]
+        out_lengths[idx[in_run]] = lengths[k[in_run]]
+        # tiles to be looked up in a leaf directory
+        for entry in np.unique(k[is_leaf]):
+            sel = is_leaf & (k == entry)
+            leaf = self._leaf(f, int(offsets[entry]), int(lengths[entry]))
+            self._resolve(
+                f, leaf, tile_ids[sel], out_offsets, out_lengths, idx[sel], depth + 1
+            )
+
+    def read_tiles(self, z, xs, ys):
+        """
+        Read the encoded content of a batch of tiles of a single zoom level.
+
+        Parameters
+        ----------
+        z : int
+            Zoom level of the tiles.
+        xs, ys : array_like of int
+            Column and row (XYZ scheme) of each tile.
+
+        Returns
+        -------
+        list of bytes or None
+            Encoded tile images, in the order of `xs` and `ys`. Tiles that
+            are not in the archive are None.
+        """
+        tile_ids = np.array(
+            [_zxy_to_tileid(int(z), int(x), int(y)) for x, y in zip(xs, ys)],
+            dtype=np.uint64,
+        )
+        n = len(tile_ids)
+        offsets = np.zeros(n, dtype=np.uint64)
+        lengths = np.zeros(n, dtype=np.uint64)
+        contents = [None] * n
+        with open(self.path, "rb") as f:
+            self._resolve(
+                f, self._root, tile_ids, offsets, lengths, np.arange(n), 0
+            )
+            found = np.flatnonzero(lengths)
+            # read the tiles in file order, merging contiguous (or shared,
+            # deduplicated) byte ranges into a single read
+            found = found[np.argsort(offsets[found], kind="stable")]
+            start = 0
+            while start < len(found):
+                stop = start + 1
+                end = int(offsets[found[start]] + lengths[found[start]])
+                while stop < len(found) and int(offsets[found[stop]]) <= end:
+                    end = max(end, int(offsets[found[stop]] + lengths[found[stop]]))
+                    stop += 1
+                first = int(offsets[found[start]])
+                f.seek(self._data_offset + first)
+                block = f.read(end - first)
+                for i in found[start:stop]:
+                    lo = int(offsets[i]) - first
+                    data = block[lo : lo + int(lengths[i])]
+                    contents[i] = self._decompress(data, self._tile_compression)
+                start = stop
+        return contents
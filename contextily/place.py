@@ -1,5 +1,12 @@
 """Tools for generating maps from a text search."""
 
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import closing
+
 import geopy as gp
 import numpy as np
 import matplotlib.pyplot as plt
@@ -12,6 +19,85 @@ from xyzservices import TileProvider
 # Set user ID for Nominatim
 _val = np.random.randint(1000000)
 _default_user_agent = f"contextily_user_{_val}"
+_default_geocoder = None
+
+
+def _get_default_geocoder():
+    """
+    Return the default Nominatim geocoder, creating it on first use.
+    """
+    global _default_geocoder
+    if _default_geocoder is None:
+        _default_geocoder = gp.geocoders.Nominatim(user_agent=_default_user_agent)
+    return _default_geocoder
+
+
+_geocode_cache_lock = threading.Lock()
+
+
+def _geocode_cache_path(path=None):
+    """
+    Path of the geocoding cache, a SQLite database: `path` if given, or
+    ``geocode.sqlite`` in the user cache directory of contextily
+    (``$XDG_CACHE_HOME/contextily``, ``~/.cache/contextily`` by default, or
+    ``%LOCALAPPDATA%\\contextily`` on Windows), kept across sessions.
+    """
+    if path is None:
+        if sys.platform == "win32":
+            base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        else:
+            base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser(
+                os.path.join("~", ".cache")
+            )
+        path = os.path.join(base, "contextily", "geocode.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return path
+
+
+def _geocoder_key(geocoder):
+    """
+    Identify a geocoder (its class and the service it queries) in the cache.
+    """
+    return "{}:{}".format(type(geocoder).__name__, getattr(geocoder, "domain", ""))
+
+
+def _geocode(geocoder, search, use_cache=True, geocode=None, cache_path=None):
+    """
+    Geocode `search` with `geocoder`, going through the on-disk cache (at
+    `cache_path`, see `_geocode_cache_path`) if `use_cache` is True.
+    `geocode` optionally replaces ``geocoder.geocode`` (e.g. to rate limit
+    the calls).
+    """
+    if geocode is None:
+        geocode = geocoder.geocode
+    if not use_cache:
+        return geocode(search)
+    key = (_geocoder_key(geocoder), search)
+    cache_path = _geocode_cache_path(cache_path)
+    with _geocode_cache_lock, closing(sqlite3.connect(cache_path)) as con:
+        with con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS geocode (geocoder TEXT, query TEXT, "
+                "location TEXT, PRIMARY KEY (geocoder, query))"
+            )
+        row = con.execute(
+            "SELECT location FROM geocode WHERE geocoder = ? AND query = ?", key
+        ).fetchone()
+    if row is not None:
+        cached = json.loads(row[0])
+        return gp.location.Location(cached["address"], cached["point"], cached["raw"])
+    resp = geocode(search)
+    if resp is not None:
+        location = json.dumps(
+            {"address": resp.address, "point": tuple(resp.point), "raw": resp.raw}
+        )
+        with _geocode_cache_lock, closing(sqlite3.connect(cache_path)) as con:
+            with con:
+                con.execute(
+                    "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)",
+                    (*key, location),
+                )
+    return resp
 
 
 class Place(object):
@@ -50,6 +136,17 @@ class Place(object):
         Headers to include with requests to the tile server.
     geocoder : geopy.geocoders
         [Optional. Default: geopy.geocoders.Nominatim()] Geocoder method to process `search`
+    use_cache : bool
+        [Optional. Default: True]
+        If False, neither the result of geocoding `search` nor the downloaded
+        tiles are cached. Geocoding results are cached on disk per geocoder
+        and query, and kept across sessions (see `geocode_cache`).
+    geocode_cache : str or None
+        [Optional. Default: None]
+        Path to the SQLite database in which geocoding results are cached.
+        If None, ``geocode.sqlite`` in the user cache directory
+        (``$XDG_CACHE_HOME/contextily``, ``~/.cache/contextily`` by default,
+        or ``%LOCALAPPDATA%\\contextily`` on Windows).
 
     Attributes
     ----------
@@ -64,13 +161,15 @@ class Place(object):
     w : float
         The western bbox edge.
     im : ndarray
-        The image corresponding to the map of ``search``.
+        The image corresponding to the map of ``search``. It is only
+        downloaded when first used (or when creating the place, if `path` is
+        given), see `set_zoom` to change its level of detail.
     bbox : list
         The bounding box of the returned image, expressed in lon/lat, with the
         following order: [minX, minY, maxX, maxY]
     bbox_map : tuple
         The bounding box of the returned image, expressed in Web Mercator, with the
-        following order: [minX, minY, maxX, maxY]
+        following order: [minX, minY, maxX, maxY]. Downloaded with `im`.
     timeout : float or tuple
         [Optional. Default: None] How many seconds to wait for the 
         server to send data before giving up, as a float, or a 
@@ -85,18 +184,31 @@ class Place(object):
         zoom_adjust=None,
         source=None,
         headers: dict[str, str] | None = None,
-        geocoder=gp.geocoders.Nominatim(user_agent=_default_user_agent),
-        timeout=None
+        geocoder=None,
+        timeout=None,
+        use_cache=True,
+        geocode_cache=None,
+    ):
+        # Get geocoded values
+        if geocoder is None:
+            geocoder = _get_default_geocoder()
+        resp = _geocode(
+            geocoder, search, use_cache=use_cache, cache_path=geocode_cache
+        )
+        self._setup(
+            search, resp, zoom, path, zoom_adjust, source, headers, timeout, use_cache
+        )
+
+    def _setup(
+        self, search, resp, zoom, path, zoom_adjust, source, headers, timeout, use_cache
     ):
         self.path = path
         if source is None:
             source = providers.OpenStreetMap.HOT
         self.source = source
         self.headers = headers
-        self.zoom_adjust = zoom_adjust
+        self.use_cache = use_cache
 
-        # Get geocoded values
-        resp = geocoder.geocode(search)
         bbox = np.array([float(ii) for ii in resp.raw["boundingbox"]])
 
         if "display_name" in resp.raw.keys():
@@ -114,20 +226,154 @@ class Place(object):
         self.geocode = resp
         self.timeout = timeout
 
-        # Get map params
+        # Get map params, the map itself is only downloaded when needed
+        self.set_zoom(zoom, zoom_adjust)
+
+    def set_zoom(self, zoom=None, zoom_adjust=None):
+        """
+        Change the level of detail of the map, without geocoding the place
+        again.
+
+        The map is downloaded again the next time it is used (or right away,
+        to update the raster file, if `path` was given).
+
+        Parameters
+        ----------
+        zoom : int or None
+            [Optional. Default: None]
+            The level of detail to include in the map. If None, the zoom
+            level will be automatically determined.
+        zoom_adjust : int or None
+            [Optional. Default: None]
+            The amount to adjust a chosen zoom level if it is chosen
+            automatically.
+        """
+        self.zoom_adjust = zoom_adjust
         self.zoom = (
             _calculate_zoom(self.w, self.s, self.e, self.n) if zoom is None else zoom
         )
         self.zoom = int(self.zoom)
         if self.zoom_adjust is not None:
             self.zoom += zoom_adjust
-        self.n_tiles = howmany(self.w, self.s, self.e, self.n, self.zoom, verbose=False)
+        self.n_tiles = howmany(
+            self.w, self.s, self.e, self.n, self.zoom, verbose=False, ll=True
+        )
+        self._im = self._bbox_map = None
+        if isinstance(self.path, str):
+            # writing the raster file is expected when creating the place
+            self._get_map()
+
+    @property
+    def im(self):
+        """
+        The image corresponding to the map of ``search``, downloaded on first
+        access.
+        """
+        if self._im is None:
+            self._get_map()
+        return self._im
+
+    @property
+    def bbox_map(self):
+        """
+        The bounding box of the image, expressed in Web Mercator, with the
+        following order: [minX, minY, maxX, maxY]. The image is downloaded
+        on first access.
+        """
+        if self._bbox_map is None:
+            self._get_map()
+        return self._bbox_map
+
+    @classmethod
+    def many(
+        cls,
+        searches,
+        zoom=None,
+        zoom_adjust=None,
+        source=None,
+        headers: dict[str, str] | None = None,
+        geocoder=None,
+        timeout=None,
+        use_cache=True,
+        min_delay_seconds=1,
+        n_connections=4,
+        geocode_cache=None,
+    ):
+        """
+        Geocode several places and get their maps.
+
+        Each unique search is geocoded only once (or read from the cache),
+        waiting at least `min_delay_seconds` between requests to the
+        geocoder, and the maps of all the places are then downloaded
+        concurrently.
+
+        Parameters
+        ----------
+        searches : list of str
+            The locations to be searched.
+        zoom, zoom_adjust, source, headers, geocoder, timeout, use_cache
+            [Optional] See `Place`.
+        min_delay_seconds : float
+            [Optional. Default: 1]
+            Minimum delay in seconds between two geocoding requests. The
+            default follows the usage policy of Nominatim.
+        n_connections : int
+            [Optional. Default: 4]
+            Number of maps downloaded at the same time.
+        geocode_cache : str or None
+            [Optional. Default: None]
+            Path to the cache of geocoding results, see `Place`.
+
+        Returns
+        -------
+        list of Place
+            The places, in the order of `searches`.
+
+        Examples
+        --------
 
-        # Get the map
-        self._get_map()
+        >>> places = cx.Place.many(['Liverpool', 'Manchester', 'Leeds'])
+        """
+        from geopy.extra.rate_limiter import RateLimiter
+        from joblib import Parallel, delayed
+
+        if geocoder is None:
+            geocoder = _get_default_geocoder()
+        geocode = RateLimiter(geocoder.geocode, min_delay_seconds=min_delay_seconds)
+        # geocode each unique search once, one after the other
+        responses = {
+            search: _geocode(
+                geocoder,
+                search,
+                use_cache=use_cache,
+                geocode=geocode,
+                cache_path=geocode_cache,
+            )
+            for search in dict.fromkeys(searches)
+        }
+
+        def build(search):
+            place = cls.__new__(cls)
+            place._setup(
+                search,
+                responses[search],
+                zoom,
+                None,
+                zoom_adjust,
+                source,
+                headers,
+                timeout,
+                use_cache,
+            )
+            place._get_map()
+            return place
+
+        return Parallel(n_jobs=n_connections, prefer="threads")(
+            delayed(build)(search) for search in searches
+        )
 
     def _get_map(self):
-        kwargs = {"ll": True}
+        kwargs = {"ll": True, "use_cache": self.use_cache}
         if self.source is not None:
             kwargs["source"] = self.source
         if self.headers is not None:
@@ -152,8 +398,8 @@ class Place(object):
                 )
             )
 
-        self.im = im
-        self.bbox_map = bbox
+        self._im = im
+        self._bbox_map = bbox
         return im, bbox
 
     def plot(self, ax=None, zoom=ZOOM, interpolation=INTERPOLATION, attribution=None):
@@ -219,7 +465,8 @@ class Place(object):
         return ax
 
     def __repr__(self):
+        im = "not loaded" if self._im is None else self._im.shape[:2]
         s = "Place : {} | n_tiles: {} | zoom : {} | im : {}".format(
-            self.place, self.n_tiles, self.zoom, self.im.shape[:2]
+            self.place, self.n_tiles, self.zoom, im
         )
         return s
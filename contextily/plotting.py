@@ -4,15 +4,28 @@ import warnings
 import numpy as np
 from . import providers
 from xyzservices import TileProvider
-from .tile import bounds2img, _sm2ll, warp_tiles, _warper
+from .tile import (
+    _archive_provider,
+    _fetch_tiles,
+    _grid_xy,
+    _merge_tiles,
+    _plan_tiles,
+    _process_source,
+    _sm2ll,
+    _upsample_grid,
+    warp_tiles,
+)
+from .archive import _is_archive_path
 from rasterio.enums import Resampling
 from rasterio.warp import transform_bounds
 from matplotlib import patheffects
-from matplotlib.pyplot import draw
+from matplotlib.image import AxesImage
 
 INTERPOLATION = "bilinear"
 ZOOM = "auto"
 ATTRIBUTION_SIZE = 8
+# tiles kept in memory by an interactive basemap
+INTERACTIVE_MAX_TILES = 1024
 
 
 def add_basemap(
@@ -28,6 +41,15 @@ def add_basemap(
     resampling=Resampling.bilinear,
     zoom_adjust=None,
     timeout=None,
+    overzoom=False,
+    pyramid_levels=0,
+    max_tiles=None,
+    max_bytes=None,
+    budget_action="reduce",
+    interactive=False,
+    lazy=False,
+    downsample=None,
+    store=None,
     **extra_imshow_args,
 ):
     """
@@ -41,15 +63,20 @@ def add_basemap(
         keyword is specified.
     zoom : int or 'auto'
         [Optional. Default='auto'] Level of detail for the basemap. If 'auto',
-        it is calculated automatically. Ignored if `source` is a local file.
+        it is calculated automatically from the size in pixels of `ax` (given
+        the figure DPI) and the tile size of the provider, so that the tiles
+        just fill the rendered axes. Ignored if `source` is a local file.
     source : xyzservices.TileProvider object or str
         [Optional. Default: OpenStreetMap Humanitarian web tiles]
         The tile source: web tile provider, a valid input for a query of a
         :class:`xyzservices.TileProvider` by a name from ``xyzservices.providers`` or
         path to local file. The web tile provider can be in the form of a
         :class:`xyzservices.TileProvider` object or a URL. The placeholders for the XYZ
-        in the URL need to be `{x}`, `{y}`, `{z}`, respectively. For local file paths,
-        the file is read with `rasterio` and all bands are loaded into the basemap.
+        in the URL need to be `{x}`, `{y}`, `{z}`, respectively. A ``file://`` URL
+        template (e.g. ``file:///tiles/{z}/{x}/{y}.png``) reads the tiles directly
+        from a local directory tree, and a path to an ``.mbtiles`` or ``.pmtiles``
+        archive reads the tiles from that archive. For other local file paths, the
+        file is read with `rasterio` and all bands are loaded into the basemap.
         IMPORTANT: tiles are assumed to be in the Spherical Mercator projection
         (EPSG:3857), unless the `crs` keyword is specified.
     headers : dict or None
@@ -89,9 +116,63 @@ def add_basemap(
         [Optional. Default=None] How many seconds to wait for the 
         server to send data before giving up, as a float, or a 
         (connect timeout, read timeout) tuple.
+    overzoom : bool
+        [Optional. Default=False] If True, a zoom level beyond the maximum
+        zoom of the provider is served by upsampling the tiles at the
+        maximum zoom, instead of raising an error (or, for an automatically
+        chosen zoom, clipping it to the maximum zoom). Ignored if `source`
+        is a local file.
+    pyramid_levels : int
+        [Optional. Default=0] If larger than 0, tiles that are not cached yet
+        are built by downsampling their cached children up to this many zoom
+        levels higher, when all of them are cached, instead of being
+        downloaded. Ignored if `source` is a local file.
+    max_tiles : int or None
+        [Optional. Default=None] Maximum number of tiles to fetch, checked
+        against the planned tiles before anything is downloaded. Ignored if
+        `source` is a local file.
+    max_bytes : int or None
+        [Optional. Default=None] Maximum size in bytes of the fetched image
+        (4 bytes per pixel), checked against the planned tiles before
+        anything is downloaded. Ignored if `source` is a local file.
+    budget_action : {'reduce', 'raise'}
+        [Optional. Default='reduce'] If the planned tiles exceed `max_tiles`
+        or `max_bytes`, 'reduce' lowers the zoom level until they fit and
+        'raise' raises a ValueError.
+    interactive : bool
+        [Optional. Default=False] If True, the basemap is updated in place
+        when the limits of `ax` change (e.g. when panning or zooming
+        interactively): only the tiles newly exposed, or those at the new
+        zoom level, are fetched, and the tiles already in memory are reused.
+        Ignored if `source` is a local file.
+    lazy : bool
+        [Optional. Default=False] If True, no tile is fetched when calling
+        this function. A :class:`BasemapArtist` is added to `ax` instead,
+        which fetches the tiles for the current view when the figure is
+        rendered, so that figures never drawn download nothing. As it
+        follows the view of `ax` every time it is drawn, `interactive` is
+        ignored. Ignored if `source` is a local file.
+    downsample : float or None
+        [Optional. Default=None] If given, the basemap is reduced with an
+        area (box) filter to at most `downsample` times the resolution at
+        which `ax` displays it (e.g. 1, or 2 to keep some detail for
+        zooming in) before being passed to `imshow`. This saves memory and
+        rendering time when the fetched image is larger than needed. Local
+        files are read directly at that resolution, from their overviews if
+        they have any. If None, the image is plotted at full resolution.
+    store : TileStore or None
+        [Optional. Default=None] Store in which the tiles are cached (see
+        :class:`TileStore`), instead of the default one in the cache
+        directory. Ignored if `source` is a local file.
     **extra_imshow_args :
         Other parameters to be passed to `imshow`.
 
+    Returns
+    -------
+    BasemapArtist or None
+        The basemap if `lazy` is True and `source` is a tile source, None
+        otherwise.
+
     Examples
     --------
 
@@ -119,8 +200,12 @@ def add_basemap(
 
     """
     xmin, xmax, ymin, ymax = ax.axis()
+    # tiles kept in memory to update an interactive basemap
+    tiles = None
 
-    if isinstance(source, str):
+    if _is_archive_path(source):
+        source = _archive_provider(source)
+    elif isinstance(source, str):
         try:
             source = providers.query_name(source)
         except ValueError:
@@ -131,30 +216,29 @@ def add_basemap(
         source is None
         or isinstance(source, (dict, TileProvider))
         or (isinstance(source, str) and source[:4] == "http")
+        or (isinstance(source, str) and source[:7] == "file://")
     ):
-        # Extent
-        left, right, bottom, top = xmin, xmax, ymin, ymax
-        # Convert extent from `crs` into WM for tile query
-        if crs is not None:
-            left, right, bottom, top = _reproj_bb(
-                left, right, bottom, top, crs, "epsg:3857"
-            )
-        # Download image
-        image, extent = bounds2img(
-            left,
-            bottom,
-            right,
-            top,
+        fetch_kwargs = dict(
             zoom=zoom,
-            source=source,
             headers=headers,
-            ll=False,
             zoom_adjust=zoom_adjust,
-            timeout=timeout
+            timeout=timeout,
+            overzoom=overzoom,
+            pyramid_levels=pyramid_levels,
+            max_tiles=max_tiles,
+            max_bytes=max_bytes,
+            budget_action=budget_action,
+            downsample=downsample,
+            store=store,
         )
-        # Warping
-        if crs is not None:
-            image, extent = warp_tiles(image, extent, t_crs=crs, resampling=resampling)
+        if lazy:
+            # fetched when drawn, see BasemapArtist
+            image, extent = None, (xmin, xmax, ymin, ymax)
+        else:
+            tiles = {} if interactive else None
+            image, extent = _view_image(
+                ax, source, crs, resampling, tiles, **fetch_kwargs
+            )
         # Check if overlay
         if _is_overlay(source) and "zorder" not in extra_imshow_args:
             # If zorder was not set then make it 9 otherwise leave it
@@ -165,7 +249,22 @@ def add_basemap(
 
         # Read file
         with rio.open(source) as raster:
-            if reset_extent:
+            if (crs is not None) and (raster.crs != crs):
+                from rasterio.vrt import WarpedVRT
+
+                # Warp and read the window in view in a single pass
+                view = xmin, ymin, xmax, ymax
+                with WarpedVRT(raster, crs=crs, resampling=resampling) as vrt:
+                    image, _, extent = _read_for_axes(
+                        vrt, ax, view, downsample, bounds=view if reset_extent else None
+                    )
+            elif downsample is not None:
+                # only read the resolution needed to display the raster
+                view = xmin, ymin, xmax, ymax
+                image, _, extent = _read_for_axes(
+                    raster, ax, view, downsample, bounds=view if reset_extent else None
+                )
+            elif reset_extent:
                 from rasterio.mask import mask as riomask
 
                 # Read window
@@ -189,32 +288,40 @@ def add_basemap(
                         ),
                     }
                 ]
-                image, img_transform = riomask(raster, window, crop=True)
+                image, _ = riomask(raster, window, crop=True)
                 extent = left, right, bottom, top
             else:
                 # Read full
-                image = np.array([band for band in raster.read()])
-                img_transform = raster.transform
+                image = raster.read()
                 bb = raster.bounds
                 extent = bb.left, bb.right, bb.bottom, bb.top
-            # Warp
-            if (crs is not None) and (raster.crs != crs):
-                image, bounds, _ = _warper(
-                    image, img_transform, raster.crs, crs, resampling
-                )
-                extent = bounds.left, bounds.right, bounds.bottom, bounds.top
             image = image.transpose(1, 2, 0)
+        if downsample is not None:
+            image = _fit_to_axes(image, extent, ax, downsample)
 
     # Plotting
-    if image.shape[2] == 1:
-        image = image[:, :, 0]
-    _ = ax.imshow(
-        image,
-        extent=extent,
-        interpolation=interpolation,
-        aspect=ax.get_aspect(),  # GH251
-        **extra_imshow_args,
-    )
+    if image is None:
+        im = BasemapArtist(
+            ax,
+            source,
+            crs=crs,
+            resampling=resampling,
+            interpolation=interpolation,
+            **fetch_kwargs,
+            **extra_imshow_args,
+        )
+        im.set_extent(extent)
+        ax.add_image(im)
+    else:
+        if image.shape[2] == 1:
+            image = image[:, :, 0]
+        im = ax.imshow(
+            image,
+            extent=extent,
+            interpolation=interpolation,
+            aspect=ax.get_aspect(),  # GH251
+            **extra_imshow_args,
+        )
 
     if reset_extent:
         ax.axis((xmin, xmax, ymin, ymax))
@@ -226,6 +333,8 @@ def add_basemap(
             max(ymax, extent[3]),
         )
         ax.axis(max_bounds)
+    if tiles is not None:
+        _connect_refresh(ax, im, source, crs, resampling, tiles, fetch_kwargs)
 
     # Add attribution text
     if source is None:
@@ -235,9 +344,340 @@ def add_basemap(
     if attribution:
         add_attribution(ax, attribution, font_size=attribution_size)
 
+    if isinstance(im, BasemapArtist):
+        return im
     return
 
 
+def _view_image(
+    ax,
+    source,
+    crs=None,
+    resampling=Resampling.bilinear,
+    tiles=None,
+    zoom=ZOOM,
+    headers=None,
+    zoom_adjust=None,
+    timeout=None,
+    overzoom=False,
+    pyramid_levels=0,
+    max_tiles=None,
+    max_bytes=None,
+    budget_action="reduce",
+    downsample=None,
+    store=None,
+    renderer=None,
+    mosaics=None,
+):
+    """
+    Fetch the tiles covering the current view of `ax` and return the image
+    and its extent, in `crs` (Spherical Mercator if None).
+
+    `tiles` is an optional mapping of (z, x, y) to tiles already in memory,
+    which are reused, and `mosaics` an optional mapping of zoom levels to
+    the last (grid, image, extent) built at that zoom, reused if it covers
+    the view. The size of `ax` is measured with `renderer` if given. See
+    `add_basemap` for the other parameters.
+    """
+    (left, right), (bottom, top) = ax.get_xlim(), ax.get_ylim()
+    # Convert extent from `crs` into WM for tile query
+    if crs is not None:
+        left, right, bottom, top = _reproj_bb(
+            left, right, bottom, top, crs, "epsg:3857"
+        )
+    w, s = _sm2ll(left, bottom)
+    e, n = _sm2ll(right, top)
+    provider = _process_source(source)
+    grid, target_grid = _plan_tiles(
+        w,
+        s,
+        e,
+        n,
+        zoom,
+        provider,
+        zoom_adjust=zoom_adjust,
+        overzoom=overzoom,
+        display_shape=_axes_pixel_shape(ax, renderer),
+        max_tiles=max_tiles,
+        max_bytes=max_bytes,
+        budget_action=budget_action,
+    )
+    if mosaics is not None:
+        cached = mosaics.get(target_grid.z)
+        if cached is not None and _grid_covers(cached[0], target_grid):
+            image, extent = cached[1:]
+            if downsample is not None:
+                image = _fit_to_axes(image, extent, ax, downsample, renderer)
+            return image, extent
+    xs, ys = _grid_xy(grid)
+    arrays = _fetch_tiles(
+        provider,
+        grid.z,
+        xs,
+        ys,
+        headers=headers,
+        timeout=timeout,
+        pyramid_levels=pyramid_levels,
+        tiles=tiles,
+        store=store,
+    )
+    image, extent = _merge_tiles(grid, arrays)
+    if target_grid is not grid:
+        image, extent = _upsample_grid(image, grid, target_grid)
+    # Warping
+    if crs is not None:
+        image, extent = warp_tiles(image, extent, t_crs=crs, resampling=resampling)
+    if mosaics is not None:
+        mosaics[target_grid.z] = (target_grid, image, extent)
+    if downsample is not None:
+        image = _fit_to_axes(image, extent, ax, downsample, renderer)
+    return image, extent
+
+
+def _fit_to_axes(image, extent, ax, factor, renderer=None):
+    """
+    Reduce `image`, covering `extent`, with an area filter to at most
+    `factor` times the resolution at which `ax` displays it. Images already
+    coarser are returned unchanged.
+    """
+    from PIL import Image
+
+    height, width = _axes_pixel_shape(ax, renderer)
+    (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+    size = (
+        int(np.ceil(factor * width * abs(extent[1] - extent[0]) / abs(x1 - x0))),
+        int(np.ceil(factor * height * abs(extent[3] - extent[2]) / abs(y1 - y0))),
+    )
+    size = (
+        max(min(size[0], image.shape[1]), 1),
+        max(min(size[1], image.shape[0]), 1),
+    )
+    if size == (image.shape[1], image.shape[0]):
+        return image
+    if image.dtype == np.uint8 and image.shape[2] in (3, 4):
+        with Image.fromarray(image) as img:
+            return np.asarray(img.resize(size, resample=Image.Resampling.BOX))
+    # other rasters (e.g. local files) are reduced band by band
+    bands = []
+    for band in np.moveaxis(image, 2, 0):
+        with Image.fromarray(band.astype(np.float32)) as img:
+            bands.append(np.asarray(img.resize(size, resample=Image.Resampling.BOX)))
+    reduced = np.stack(bands, axis=2)
+    if np.issubdtype(image.dtype, np.integer):
+        reduced = np.rint(reduced)
+    return reduced.astype(image.dtype)
+
+
+def _read_for_axes(raster, ax, view, factor=None, bounds=None):
+    """
+    Read the bands of the open rasterio dataset (or VRT) `raster` within
+    `bounds` (left, bottom, right, top, the whole raster if None). If
+    `factor` is given, the bands are decimated to at most `factor` times the
+    resolution at which `ax` displays `view` (given in the CRS of `raster`).
+    Decimated reads use the overviews of the file, if any.
+
+    Returns the image (bands first), its transform and its extent (left,
+    right, bottom, top).
+    """
+    from rasterio.transform import Affine
+    from rasterio.windows import Window, WindowError, from_bounds
+
+    window = Window(0, 0, raster.width, raster.height)
+    if bounds is not None:
+        try:
+            window = from_bounds(*bounds, transform=raster.transform).intersection(
+                window
+            )
+        except WindowError:
+            raise ValueError("Input shapes do not overlap raster.")
+        # whole pixels covering the bounds
+        col_off, row_off = np.floor([window.col_off, window.row_off])
+        col_end = np.ceil(window.col_off + window.width)
+        row_end = np.ceil(window.row_off + window.height)
+        window = Window(
+            int(col_off), int(row_off), int(col_end - col_off), int(row_end - row_off)
+        )
+    left, bottom, right, top = raster.window_bounds(window)
+    out_width, out_height = window.width, window.height
+    if factor is not None:
+        height, width = _axes_pixel_shape(ax)
+        out_width = np.ceil(factor * width * (right - left) / abs(view[2] - view[0]))
+        out_height = np.ceil(factor * height * (top - bottom) / abs(view[3] - view[1]))
+        out_width = int(min(max(out_width, 1), window.width))
+        out_height = int(min(max(out_height, 1), window.height))
+    image = raster.read(
+        window=window,
+        out_shape=(raster.count, out_height, out_width),
+        resampling=Resampling.average,
+    )
+    transform = raster.window_transform(window) * Affine.scale(
+        window.width / out_width, window.height / out_height
+    )
+    return image, transform, (left, right, bottom, top)
+
+
+def _grid_covers(grid, other):
+    """
+    Check if the tile grid `grid` contains all the tiles of `other`.
+    """
+    return (
+        grid.z == other.z
+        and grid.x_min <= other.x_min
+        and grid.x_min + grid.n_x >= other.x_min + other.n_x
+        and grid.y_min <= other.y_min
+        and grid.y_min + grid.n_y >= other.y_min + other.n_y
+    )
+
+
+class BasemapArtist(AxesImage):
+    """
+    Basemap image that fetches its tiles when it is drawn.
+
+    Every time the figure is rendered, the zoom level is resolved from the
+    current view of the axes and their size in pixels for the renderer (so
+    that saving a figure at a higher DPI fetches more detailed tiles), and
+    the tiles are only fetched if no mosaic built before at that zoom level
+    covers the view. Usually created by ``add_basemap(..., lazy=True)``.
+
+    Parameters
+    ----------
+    ax : AxesSubplot
+        Matplotlib axes object the basemap belongs to. The artist still needs
+        to be added with ``ax.add_image``.
+    source : xyzservices.TileProvider object or str
+        [Optional. Default: OpenStreetMap Humanitarian web tiles]
+        The tile source, see `add_basemap`.
+    crs : None or str or CRS
+        [Optional. Default=None] coordinate reference system of `ax`, see
+        `add_basemap`.
+    resampling : <enum 'Resampling'>
+        [Optional. Default=Resampling.bilinear] Resampling method for
+        warping the tiles into `crs`.
+    zoom, headers, zoom_adjust, timeout, overzoom, pyramid_levels
+        [Optional] Options of the tiles fetched, see `add_basemap`.
+    max_tiles, max_bytes, budget_action
+        [Optional] Budget of the tiles fetched, see `add_basemap`.
+    downsample : float or None
+        [Optional. Default=None] Maximum resolution of the image drawn,
+        relative to the display, see `add_basemap`.
+    store : TileStore or None
+        [Optional. Default=None] Store in which the tiles are cached, see
+        `add_basemap`.
+    **kwargs
+        Other parameters passed to `matplotlib.image.AxesImage`.
+
+    Attributes
+    ----------
+    mosaics : dict
+        The last mosaic fetched at each zoom level, as (tile grid, image,
+        extent) tuples.
+    """
+
+    def __init__(
+        self,
+        ax,
+        source=None,
+        crs=None,
+        resampling=Resampling.bilinear,
+        zoom=ZOOM,
+        headers=None,
+        zoom_adjust=None,
+        timeout=None,
+        overzoom=False,
+        pyramid_levels=0,
+        max_tiles=None,
+        max_bytes=None,
+        budget_action="reduce",
+        downsample=None,
+        store=None,
+        **kwargs,
+    ):
+        super().__init__(ax, **kwargs)
+        self.source = source
+        self.crs = crs
+        self.resampling = resampling
+        self._fetch_kwargs = dict(
+            zoom=zoom,
+            headers=headers,
+            zoom_adjust=zoom_adjust,
+            timeout=timeout,
+            overzoom=overzoom,
+            pyramid_levels=pyramid_levels,
+            max_tiles=max_tiles,
+            max_bytes=max_bytes,
+            budget_action=budget_action,
+            downsample=downsample,
+            store=store,
+        )
+        self.mosaics = {}
+        self._shown = None
+
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+        image, extent = _view_image(
+            self.axes,
+            self.source,
+            self.crs,
+            self.resampling,
+            renderer=renderer,
+            mosaics=self.mosaics,
+            **self._fetch_kwargs,
+        )
+        if self._shown is not image:
+            self._shown = image
+            self.set_data(image[:, :, 0] if image.shape[2] == 1 else image)
+            self.set_extent(extent)
+        super().draw(renderer)
+
+
+def _connect_refresh(ax, im, source, crs, resampling, tiles, fetch_kwargs):
+    """
+    Update the basemap image `im` in place whenever the limits of `ax`
+    change, keeping up to `INTERACTIVE_MAX_TILES` tiles in `tiles`.
+    """
+    state = {"view": ax.get_xlim() + ax.get_ylim(), "busy": False}
+
+    def refresh(_):
+        view = ax.get_xlim() + ax.get_ylim()
+        if state["busy"] or view == state["view"]:
+            return
+        state["busy"] = True
+        try:
+            image, extent = _view_image(
+                ax, source, crs, resampling, tiles, **fetch_kwargs
+            )
+            if image.shape[2] == 1:
+                image = image[:, :, 0]
+            im.set_data(image)
+            im.set_extent(extent)
+            # setting the extent may autoscale the axes: keep the view
+            ax.axis(view)
+            state["view"] = view
+            # forget the oldest tiles
+            for key in list(tiles)[: max(len(tiles) - INTERACTIVE_MAX_TILES, 0)]:
+                del tiles[key]
+        finally:
+            state["busy"] = False
+
+    ax.callbacks.connect("xlim_changed", refresh)
+    ax.callbacks.connect("ylim_changed", refresh)
+    return refresh
+
+
+def _axes_pixel_shape(ax, renderer=None):
+    """
+    Size (height, width) in display pixels of `ax`, at the DPI of its figure
+    (or of `renderer`, if given).
+    """
+    if renderer is None:
+        # outside of a draw, the box of the axes does not reflect its aspect
+        # (e.g. equal for GeoPandas plots) yet
+        ax.apply_aspect()
+    bbox = ax.get_window_extent(renderer)
+    return bbox.height, bbox.width
+
+
 def _reproj_bb(left, right, bottom, top, s_crs, t_crs):
     n_l, n_b, n_r, n_t = transform_bounds(s_crs, t_crs, left, bottom, right, top)
     return n_l, n_r, n_b, n_t
@@ -303,11 +743,6 @@ def add_attribution(ax, text, font_size=ATTRIBUTION_SIZE, **kwargs):
     matplotlib.text.Text
                           Matplotlib Text object added to the plot.
     """
-    # Add draw() as it resizes the axis and allows the wrapping to work as
-    # expected. See https://github.com/darribas/contextily/issues/95 for some
-    # details on the issue
-    draw()
-
     text_artist = ax.text(
         0.005,
         0.005,
@@ -320,6 +755,9 @@ def add_attribution(ax, text, font_size=ATTRIBUTION_SIZE, **kwargs):
     )
     # hack to have the text wrapped in the ax extent, for some explanation see
     # https://stackoverflow.com/questions/48079364/wrapping-text-not-working-in-matplotlib
-    wrap_width = ax.get_window_extent().width * 0.99
-    text_artist._get_wrap_line_width = lambda: wrap_width
+    # The width is only looked up when the text is drawn, so that the layout
+    # of the figure is final by then (see
+    # https://github.com/darribas/contextily/issues/95) without having to
+    # render the figure here.
+    text_artist._get_wrap_line_width = lambda: ax.get_window_extent().width * 0.99
     return text_artist
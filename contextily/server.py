@@ -0,0 +1,297 @@
+"""A local caching proxy for a tile provider."""
+
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import numpy as np
+
+from .archive import _is_archive_path, open_archive
+from .tile import (
+    _build_urls,
+    _cache_store,
+    _download_tile,
+    _is_local_tiles,
+    _process_source,
+    _single_flight,
+)
+
+__all__ = ["make_server", "serve"]
+
+_TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)(@\d+x)?(?:\.\w+)?$")
+
+_CONTENT_TYPES = (
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def _content_type(content):
+    """
+    Guess the media type of an encoded tile from its first bytes.
+    """
+    for magic, content_type in _CONTENT_TYPES:
+        if content.startswith(magic):
+            return content_type
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class _RateLimiter(object):
+    """
+    Space calls to `wait` at least 1 / `max_rate` seconds apart, across
+    threads. No limit if `max_rate` is None.
+    """
+
+    def __init__(self, max_rate=None):
+        self.interval = 0 if max_rate is None else 1.0 / max_rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(slot - now)
+
+
+class TileProxy(object):
+    """Fetch tiles from a provider through the tile cache, with a bounded
+    pool of connections and a rate limit.
+
+    See `make_server` for the parameters.
+    """
+
+    def __init__(
+        self,
+        source=None,
+        headers=None,
+        max_rate=None,
+        n_connections=4,
+        wait=0,
+        max_retries=2,
+        timeout=None,
+        store=None,
+    ):
+        import requests
+
+        if n_connections < 1:
+            raise ValueError("n_connections must be strictly positive.")
+        self.provider = _process_source(source)
+        self.headers = {} if headers is None else headers
+        self.wait = wait
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.store = store
+        self._limiter = _RateLimiter(max_rate)
+        self._connections = threading.BoundedSemaphore(n_connections)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=n_connections
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def tile_url(self, z, x, y):
+        """
+        Return the URL of a tile at the provider.
+        """
+        return _build_urls(self.provider, z, np.array([x]), np.array([y]))[0]
+
+    def get_tile(self, z, x, y):
+        """
+        Return the encoded content of a tile, from the cache if possible.
+        Concurrent requests for the same tile are sent to the provider once.
+        Tiles of tile archives and ``file://`` sources are read directly,
+        and are None if they do not exist.
+        """
+        if _is_archive_path(self.provider["url"]):
+            return open_archive(self.provider["url"]).read_tiles(z, [x], [y])[0]
+        tile_url = self.tile_url(z, x, y)
+        if _is_local_tiles(self.provider):
+            try:
+                with open(url2pathname(urlparse(tile_url).path), "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+        content = self._store().get(tile_url)
+        if content is None:
+            content = _single_flight(
+                ("bytes", tile_url), lambda: self._download(tile_url)
+            )
+        return content
+
+    def _download(self, tile_url):
+        # cached by a download that finished since the lookup in get_tile
+        content = self._store().get(tile_url)
+        if content is not None:
+            return content
+        with self._connections:
+            # every request, retries included, goes through the rate limiter
+            # passed on as is, without decoding it
+            content = _download_tile(
+                tile_url,
+                self.wait,
+                self.max_retries,
+                self.headers,
+                timeout=self.timeout,
+                session=self.session,
+                before_request=self._limiter.wait,
+            )
+        self._store().put(tile_url, content)
+        return content
+
+    def _store(self):
+        # the default store follows the cache directory, see set_cache_dir
+        return _cache_store(True, self.store)
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    server_version = "contextily"
+
+    def do_GET(self):
+        import requests
+
+        match = _TILE_PATH.match(self.path.split("?")[0])
+        if match is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Expected a /{z}/{x}/{y} path")
+            return
+        if match.group(4) is not None:
+            # only tiles of the resolution of the provider are proxied
+            self.send_error(HTTPStatus.NOT_FOUND, "High resolution tiles not served")
+            return
+        z, x, y = (int(v) for v in match.groups()[:3])
+        if x >= 2**z or y >= 2**z:
+            self.send_error(HTTPStatus.NOT_FOUND, "Tile out of range")
+            return
+        try:
+            content = self.server.proxy.get_tile(z, x, y)
+        except requests.RequestException as exc:
+            response = getattr(exc, "response", None)
+            if response is not None and response.status_code == 404:
+                self.send_error(HTTPStatus.NOT_FOUND, "Tile not found upstream")
+            else:
+                self.send_error(HTTPStatus.BAD_GATEWAY, str(exc).split("\n")[0])
+            return
+        if content is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Tile not found")
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", _content_type(content))
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(
+    source=None,
+    host="127.0.0.1",
+    port=8080,
+    headers=None,
+    max_rate=None,
+    n_connections=4,
+    wait=0,
+    max_retries=2,
+    timeout=None,
+    store=None,
+    verbose=False,
+):
+    """
+    Create an HTTP server that proxies the tiles of a provider through the
+    contextily tile cache.
+
+    Tiles are served at ``http://{host}:{port}/{z}/{x}/{y}.png`` (any
+    extension, or none; high resolution ``@2x`` tiles are not served), which
+    can be passed as `source` to the other functions of contextily. Each tile is requested from the provider once,
+    and afterwards served from the cache (see `set_cache_dir`).
+
+    Parameters
+    ----------
+    source : xyzservices.TileProvider object or str
+        [Optional. Default: OpenStreetMap Humanitarian web tiles]
+        The tile source to proxy: web tile provider or URL. Tile archives
+        (``.mbtiles`` or ``.pmtiles`` files) and ``file://`` URLs are also
+        served, read directly instead of through the cache.
+    host : str
+        [Optional. Default: '127.0.0.1'] Address to listen on.
+    port : int
+        [Optional. Default: 8080] Port to listen on, 0 picks a free port.
+    headers : dict[str, str] or None
+        [Optional. Default: None]
+        Headers to include with the requests to the provider.
+    max_rate : float or None
+        [Optional. Default: None]
+        Maximum number of requests per second sent to the provider.
+    n_connections : int
+        [Optional. Default: 4]
+        Maximum number of concurrent connections to the provider.
+    wait : int
+        [Optional. Default: 0]
+        If the tile API is rate-limited, the number of seconds to wait
+        between a failed request and the next try.
+    max_retries : int
+        [Optional. Default: 2]
+        Total number of rejected requests allowed before giving up on a tile.
+    timeout : float or tuple
+        [Optional. Default: None] How many seconds to wait for the
+        provider to send data before giving up.
+    store : TileStore or None
+        [Optional. Default: None]
+        Store in which the tiles are cached, instead of the default one in
+        the cache directory.
+    verbose : bool
+        [Optional. Default: False] If True, log the requests served.
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        The server, not started yet (see `serve_forever`). Its `proxy`
+        attribute is the `TileProxy` fetching the tiles.
+    """
+    server = ThreadingHTTPServer((host, port), _TileHandler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    server.proxy = TileProxy(
+        source,
+        headers=headers,
+        max_rate=max_rate,
+        n_connections=n_connections,
+        wait=wait,
+        max_retries=max_retries,
+        timeout=timeout,
+        store=store,
+    )
+    return server
+
+
+def serve(source=None, host="127.0.0.1", port=8080, **kwargs):
+    """
+    Run a caching tile proxy until interrupted. See `make_server` for the
+    parameters.
+    """
+    server = make_server(source, host=host, port=port, **kwargs)
+    print(
+        "Serving tiles at http://{}:{}/{{z}}/{{x}}/{{y}}.png".format(
+            *server.server_address[:2]
+        )
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
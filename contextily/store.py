@@ -0,0 +1,413 @@
+"""Storage of downloaded tiles."""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+__all__ = [
+    "TileStore",
+    "MemoryTileStore",
+    "FileTileStore",
+    "SQLiteTileStore",
+    "DecodedTileCache",
+]
+
+
+class TileStore(object):
+    """Interface of the stores used to cache tiles.
+
+    A store maps keys (the URLs of the tiles) to the encoded content of the
+    tiles, as bytes. It must be safe to use from concurrent threads, and
+    picklable to be used by worker processes. Any object with the methods
+    below can be passed as `store` to `bounds2img`, `bounds2raster` or
+    `add_basemap`. Subclasses only need to implement `get`, `put` and
+    `delete`.
+    """
+
+    def get(self, key):
+        """
+        Return the content stored under `key`, or None if there is none.
+        """
+        raise NotImplementedError
+
+    def put(self, key, content):
+        """
+        Store `content` (bytes) under `key`, replacing any previous content.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Remove the content stored under `key`, if any.
+        """
+        raise NotImplementedError
+
+    def contains(self, key):
+        """
+        Check if content is stored under `key`.
+        """
+        return self.get(key) is not None
+
+    def bulk_get(self, keys):
+        """
+        Return the content stored under each of `keys`, None for the keys
+        without content.
+        """
+        return [self.get(key) for key in keys]
+
+
+class MemoryTileStore(TileStore):
+    """Store tiles in memory, for the current process only.
+
+    It cannot be pickled: tiles cached in a `MemoryTileStore` are always
+    downloaded with threads, even if joblib is configured to use processes.
+
+    Parameters
+    ----------
+    max_bytes : int or None
+        [Optional. Default: None] Maximum total size of the stored tiles.
+        The least recently used tiles are dropped beyond it. Unbounded if
+        None.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._tiles = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # a copy would be sent with each task to worker processes, and the
+        # tiles they download would be lost
+        raise TypeError("MemoryTileStore cannot be shared with other processes")
+
+    def get(self, key):
+        with self._lock:
+            content = self._tiles.get(key)
+            if content is not None:
+                self._tiles.move_to_end(key)
+            return content
+
+    def put(self, key, content):
+        with self._lock:
+            self._size += len(content) - len(self._tiles.pop(key, b""))
+            self._tiles[key] = content
+            while self.max_bytes is not None and self._size > self.max_bytes:
+                _, dropped = self._tiles.popitem(last=False)
+                self._size -= len(dropped)
+
+    def delete(self, key):
+        with self._lock:
+            self._size -= len(self._tiles.pop(key, b""))
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._tiles
+
+
+class FileTileStore(TileStore):
+    """Store encoded tiles as files in a directory.
+
+    Each tile is written to a temporary file that is then atomically renamed
+    into place, so that concurrent readers and writers (threads or
+    processes) only ever see complete tiles, without any locking. Tiles are
+    kept on disk as they were downloaded, nothing is held in memory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory where the tiles are stored, created on first write.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        # spread the files over subdirectories to keep them small
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, content):
+        path = self._path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+
+class SQLiteTileStore(TileStore):
+    """Store tiles in a single SQLite database file.
+
+    Each thread uses its own connection, and the database is in write-ahead
+    logging mode, so that reads are not blocked by writes, also from other
+    processes.
+
+    Parameters
+    ----------
+    path : str
+        Path to the database file, created if it does not exist.
+    """
+
+    # maximum number of keys looked up in a single query
+    _BATCH = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (key TEXT PRIMARY KEY, content BLOB)"
+            )
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def _connect(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def get(self, key):
+        row = (
+            self._connect()
+            .execute("SELECT content FROM tiles WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return None if row is None else row[0]
+
+    def bulk_get(self, keys):
+        keys = list(keys)
+        found = {}
+        con = self._connect()
+        for start in range(0, len(keys), self._BATCH):
+            batch = keys[start : start + self._BATCH]
+            found.update(
+                con.execute(
+                    "SELECT key, content FROM tiles WHERE key IN ({})".format(
+                        ", ".join("?" * len(batch))
+                    ),
+                    batch,
+                )
+            )
+        return [found.get(key) for key in keys]
+
+    def put(self, key, content):
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO tiles (key, content) VALUES (?, ?)",
+                (key, sqlite3.Binary(content)),
+            )
+
+    def delete(self, key):
+        with self._connect() as con:
+            con.execute("DELETE FROM tiles WHERE key = ?", (key,))
+
+    def contains(self, key):
+        return (
+            self._connect()
+            .execute("SELECT 1 FROM tiles WHERE key = ?", (key,))
+            .fetchone()
+            is not None
+        )
+
+
+class DecodedTileCache(object):
+    """Cache decoded tiles in a memory-mapped file, to skip decoding them.
+
+    Tiles are stored as fixed-size RGBA records of `tile_size` x
+    `tile_size` pixels, so that reading a cached tile is a copy out of the
+    page cache, shared by all the processes of the host that use the same
+    `path`. The file holds at most `capacity` tiles: each tile can go in
+    one of a few slots, and the oldest tile there is replaced when they are
+    all taken. It is a tier in front of the tile store, filled from it (or
+    from the tiles downloaded) as tiles are needed, so it can be deleted or
+    resized at any time.
+
+    Parameters
+    ----------
+    path : str
+        Path to the cache file. It is created, or recreated if it was made
+        with another `tile_size` or `capacity`.
+    tile_size : int
+        [Optional. Default: 256] Size in pixels of the tiles. Tiles of any
+        other shape are not cached.
+    capacity : int
+        [Optional. Default: 1024] Maximum number of tiles in the cache (1024
+        tiles of 256 pixels take 256 MiB). Rounded up to a multiple of 4.
+    """
+
+    _MAGIC = b"CXDTILE1"
+    _HEADER = 64
+    _WAYS = 4
+
+    def __init__(self, path, tile_size=256, capacity=1024):
+        self.path = path
+        self.tile_size = tile_size
+        self.capacity = -(-capacity // self._WAYS) * self._WAYS
+        self.shape = (tile_size, tile_size, 4)
+        self._lock = threading.Lock()
+        self._open()
+
+    def __getstate__(self):
+        return {
+            "path": self.path,
+            "tile_size": self.tile_size,
+            "capacity": self.capacity,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _header(self):
+        return self._MAGIC + np.array(
+            [self.tile_size, self.capacity], dtype="<u4"
+        ).tobytes()
+
+    def _open(self):
+        n = self.capacity
+        digests_end = self._HEADER + 16 * n
+        # records aligned to pages
+        records_start = -(-(digests_end + 8 * n) // 4096) * 4096
+        size = records_start + n * int(np.prod(self.shape))
+        header = self._header()
+        try:
+            with open(self.path, "rb") as f:
+                valid = f.read(len(header)) == header
+        except FileNotFoundError:
+            valid = False
+        if not valid:
+            # created aside and renamed, so that other processes never see
+            # a partially initialised file
+            folder = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(header)
+                    # sparse: only the records written take disk space
+                    f.truncate(size)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        data = np.memmap(self.path, dtype=np.uint8, mode="r+", shape=(size,))
+        self._digests = data[self._HEADER : digests_end].reshape(n, 16)
+        self._stamps = data[digests_end : digests_end + 8 * n].view("<u8")
+        self._records = data[records_start:].reshape((n,) + self.shape)
+
+    def _slots(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        start = int.from_bytes(digest[:8], "little") % (self.capacity // self._WAYS)
+        return digest, range(start * self._WAYS, (start + 1) * self._WAYS)
+
+    def get_into(self, key, out):
+        """
+        Copy the tile stored under `key` into the array `out`, of shape
+        (`tile_size`, `tile_size`, 4). Returns False, leaving `out` in an
+        undefined state, if the tile is not cached.
+        """
+        digest, slots = self._slots(key)
+        for slot in slots:
+            if self._digests[slot].tobytes() == digest:
+                out[...] = self._records[slot]
+                # the tile was not replaced while being copied
+                return self._digests[slot].tobytes() == digest
+        return False
+
+    def get(self, key):
+        """
+        Return the tile stored under `key` as a new array, or None if it is
+        not cached.
+        """
+        out = np.empty(self.shape, dtype=np.uint8)
+        return out if self.get_into(key, out) else None
+
+    def put(self, key, array):
+        """
+        Store the tile `array` under `key`. Returns False if the tile does
+        not have the shape of the records and was not stored.
+        """
+        if array.shape != self.shape or array.dtype != np.uint8:
+            return False
+        digest, slots = self._slots(key)
+        with self._lock, _FileLock(self.path):
+            free = [s for s in slots if not self._digests[s].any()]
+            same = [s for s in slots if self._digests[s].tobytes() == digest]
+            if same or free:
+                slot = (same or free)[0]
+            else:
+                slot = min(slots, key=lambda s: self._stamps[s])
+            # invalidate the slot while its record is rewritten
+            self._digests[slot] = 0
+            self._records[slot] = array
+            self._stamps[slot] = time.time_ns()
+            self._digests[slot] = np.frombuffer(digest, dtype=np.uint8)
+        return True
+
+    def clear(self):
+        """
+        Remove all the tiles from the cache.
+        """
+        with self._lock, _FileLock(self.path):
+            self._digests[:] = 0
+
+
+class _FileLock(object):
+    """
+    Exclusive advisory lock on a file, across processes. Only on platforms
+    with `fcntl`, elsewhere writes are only serialised within a process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, "rb")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
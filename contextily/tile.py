@@ -3,27 +3,28 @@
 from __future__ import absolute_import, division, print_function
 
 import uuid
+from collections import namedtuple
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 
 import mercantile as mt
-import requests
 import atexit
 import io
+import os
 import time
 import shutil
+import sys
 import tempfile
+import threading
 import warnings
 
 import numpy as np
-import rasterio as rio
-from PIL import Image, UnidentifiedImageError
-from joblib import Memory as _Memory
-from joblib import Parallel, delayed
-from rasterio.transform import from_origin
-from rasterio.io import MemoryFile
-from rasterio.vrt import WarpedVRT
-from rasterio.enums import Resampling
-from . import providers
-from xyzservices import TileProvider
+from .archive import open_archive, _is_archive_path
+from .store import FileTileStore, MemoryTileStore
+
+# NOTE: rasterio, PIL, joblib, requests and xyzservices are imported where they
+# are used, so that `import contextily` (or e.g. calling `howmany`) does not pay
+# for loading them.
 
 __all__ = [
     "bounds2raster",
@@ -31,14 +32,71 @@ __all__ = [
     "warp_tiles",
     "warp_img_transform",
     "howmany",
+    "estimate_download",
     "set_cache_dir",
 ]
 
 
 USER_AGENT = "contextily-" + uuid.uuid4().hex
 
-tmpdir = tempfile.mkdtemp()
-memory = _Memory(tmpdir, verbose=0)
+# Half the width of the world in Spherical Mercator (EPSG:3857)
+_ORIGIN_SHIFT = np.pi * 6378137.0
+
+# Rough average size in bytes of an encoded 256x256 tile, used to estimate
+# download sizes
+TILE_BYTES = 20000
+
+_tmpdir = None
+# cache directory set with set_cache_dir, the temporary one if None
+_cache_dir = None
+_store = None
+
+
+def _get_tmpdir():
+    """
+    Return the temporary cache directory of this session, creating it on
+    first use. It is deleted on exit.
+    """
+    global _tmpdir
+    if _tmpdir is None:
+        _tmpdir = tempfile.mkdtemp()
+        atexit.register(_clear_cache)
+    return _tmpdir
+
+
+def _get_cache_dir():
+    """
+    Return the cache directory, see `set_cache_dir`.
+    """
+    return _get_tmpdir() if _cache_dir is None else _cache_dir
+
+
+def _get_store():
+    """
+    Return the default store used to cache downloaded tiles, in the cache
+    directory (see `set_cache_dir`).
+    """
+    global _store
+    directory = os.path.join(_get_cache_dir(), "tiles")
+    if _store is None or _store.directory != directory:
+        _store = FileTileStore(directory)
+    return _store
+
+
+def __getattr__(name):
+    # backwards compatible access to the cache directory (formerly that of a
+    # joblib `Memory`) and to the lazily imported `requests` module
+    if name == "memory":
+        from joblib import Memory
+
+        return Memory(_get_cache_dir(), verbose=0)
+    if name == "tmpdir":
+        return _get_tmpdir()
+    if name == "requests":
+        import requests
+
+        return requests
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def set_cache_dir(path):
@@ -55,14 +113,12 @@ def set_cache_dir(path):
     path : str
         Path to the cache directory.
     """
-    memory.store_backend.location = path
+    global _cache_dir
+    _cache_dir = path
 
 
 def _clear_cache():
-    shutil.rmtree(tmpdir, ignore_errors=True)
-
-
-atexit.register(_clear_cache)
+    shutil.rmtree(_tmpdir, ignore_errors=True)
 
 
 def bounds2raster(
@@ -79,7 +135,14 @@ def bounds2raster(
     max_retries=2,
     n_connections=1,
     use_cache=True,
-    timeout=None
+    timeout=None,
+    overzoom=False,
+    pyramid_levels=0,
+    max_tiles=None,
+    max_bytes=None,
+    budget_action="reduce",
+    store=None,
+    decoded_cache=None,
 ):
     """
     Take bounding box and zoom, and write tiles into a raster file in
@@ -104,8 +167,12 @@ def bounds2raster(
         The tile source: web tile provider or path to local file. The web tile
         provider can be in the form of a :class:`xyzservices.TileProvider` object or a
         URL. The placeholders for the XYZ in the URL need to be `{x}`, `{y}`,
-        `{z}`, respectively. For local file paths, the file is read with
-        `rasterio` and all bands are loaded into the basemap.
+        `{z}`, respectively. A ``file://`` URL template (e.g.
+        ``file:///tiles/{z}/{x}/{y}.png``) reads the tiles directly from a
+        local directory tree, and a path to an ``.mbtiles`` or ``.pmtiles``
+        archive reads the tiles from that archive. For other local file paths,
+        the file is read with `rasterio` and all bands are loaded into the
+        basemap.
         IMPORTANT: tiles are assumed to be in the Spherical Mercator
         projection (EPSG:3857), unless the `crs` keyword is specified.
     headers : dict[str, str] or None
@@ -131,12 +198,50 @@ def bounds2raster(
     use_cache: bool
         [Optional. Default: True]
         If False, caching of the downloaded tiles will be disabled. This can be useful in resource constrained
-        environments, especially when using n_connections > 1, or when a tile provider's terms of use don't allow
+        environments, or when a tile provider's terms of use don't allow
         caching.
     timeout : float or tuple
         [Optional. Default: None] How many seconds to wait for the 
         server to send data before giving up, as a float, or a 
         (connect timeout, read timeout) tuple.
+    overzoom : bool
+        [Optional. Default: False]
+        If True, a zoom level beyond the maximum zoom of the provider is
+        served by fetching the tiles at the maximum zoom and upsampling them
+        to the requested zoom, instead of raising an error (or, for an
+        automatically chosen zoom, clipping it to the maximum zoom).
+    pyramid_levels : int
+        [Optional. Default: 0]
+        If larger than 0, a tile that is not cached yet is built by
+        downsampling its cached children up to `pyramid_levels` zoom levels
+        higher (4 tiles one level up, 16 tiles two levels up, ...), when all
+        of them are in the cache, instead of being downloaded. Only used if
+        `use_cache` is True.
+    max_tiles : int or None
+        [Optional. Default: None]
+        Maximum number of tiles to fetch. The planned tile grid is checked
+        against it before anything is downloaded.
+    max_bytes : int or None
+        [Optional. Default: None]
+        Maximum size in bytes of the returned image (4 bytes per pixel). The
+        planned tile grid is checked against it before anything is
+        downloaded.
+    budget_action : {'reduce', 'raise'}
+        [Optional. Default: 'reduce']
+        What to do when the planned tiles exceed `max_tiles` or `max_bytes`:
+        'reduce' lowers the zoom level (with a warning) until they fit,
+        'raise' raises a ValueError.
+    store : TileStore or None
+        [Optional. Default: None]
+        Store in which the tiles are cached (see `contextily.TileStore`),
+        instead of the default one in the cache directory (see
+        `set_cache_dir`). Ignored if `use_cache` is False.
+    decoded_cache : DecodedTileCache or None
+        [Optional. Default: None]
+        Cache of decoded tiles (see `contextily.DecodedTileCache`), from
+        which the tiles it holds are copied straight into the image, without
+        reading or decoding them. The other tiles are added to it once
+        fetched. Only used for web tiles.
 
     Returns
     -------
@@ -164,9 +269,19 @@ def bounds2raster(
         ll=True,
         n_connections=n_connections,
         use_cache=use_cache,
-        timeout=timeout
+        timeout=timeout,
+        overzoom=overzoom,
+        pyramid_levels=pyramid_levels,
+        max_tiles=max_tiles,
+        max_bytes=max_bytes,
+        budget_action=budget_action,
+        store=store,
+        decoded_cache=decoded_cache,
     )
 
+    import rasterio as rio
+    from rasterio.transform import from_origin
+
     # Write
     # ---
     h, w, b = Z.shape
@@ -209,11 +324,25 @@ def bounds2img(
     use_cache=True,
     zoom_adjust=None,
     timeout=None,
+    overzoom=False,
+    pyramid_levels=0,
+    display_shape=None,
+    max_tiles=None,
+    max_bytes=None,
+    budget_action="reduce",
+    chunks=None,
+    store=None,
+    decoded_cache=None,
 ):
     """
     Take bounding box and zoom and return an image with all the tiles
     that compose the map and its Spherical Mercator extent.
 
+    Bounding boxes crossing the antimeridian can be passed either with
+    `w` > `e` or with longitudes (eastings) beyond 180 degrees. Only the tiles
+    on both sides of the antimeridian are fetched and the image is continuous
+    across it, with an extent going past 180 degrees.
+
     Parameters
     ----------
     w : float
@@ -231,8 +360,12 @@ def bounds2img(
         The tile source: web tile provider or path to local file. The web tile
         provider can be in the form of a :class:`xyzservices.TileProvider` object or a
         URL. The placeholders for the XYZ in the URL need to be `{x}`, `{y}`,
-        `{z}`, respectively. For local file paths, the file is read with
-        `rasterio` and all bands are loaded into the basemap.
+        `{z}`, respectively. A ``file://`` URL template (e.g.
+        ``file:///tiles/{z}/{x}/{y}.png``) reads the tiles directly from a
+        local directory tree, and a path to an ``.mbtiles`` or ``.pmtiles``
+        archive reads the tiles from that archive. For other local file paths,
+        the file is read with `rasterio` and all bands are loaded into the
+        basemap.
         IMPORTANT: tiles are assumed to be in the Spherical Mercator
         projection (EPSG:3857), unless the `crs` keyword is specified.
     headers : dict[str, str] or None
@@ -258,7 +391,7 @@ def bounds2img(
     use_cache: bool
         [Optional. Default: True]
         If False, caching of the downloaded tiles will be disabled. This can be useful in resource constrained
-        environments, especially when using n_connections > 1, or when a tile provider's terms of use don't allow
+        environments, or when a tile provider's terms of use don't allow
         caching.
     zoom_adjust : int or None
         [Optional. Default: None]
@@ -268,11 +401,63 @@ def bounds2img(
         [Optional. Default: None] How many seconds to wait for the 
         server to send data before giving up, as a float, or a 
         (connect timeout, read timeout) tuple.
+    overzoom : bool
+        [Optional. Default: False]
+        If True, a zoom level beyond the maximum zoom of the provider is
+        served by fetching the tiles at the maximum zoom and upsampling them
+        to the requested zoom, instead of raising an error (or, for an
+        automatically chosen zoom, clipping it to the maximum zoom).
+    pyramid_levels : int
+        [Optional. Default: 0]
+        If larger than 0, a tile that is not cached yet is built by
+        downsampling its cached children up to `pyramid_levels` zoom levels
+        higher (4 tiles one level up, 16 tiles two levels up, ...), when all
+        of them are in the cache, instead of being downloaded. Only used if
+        `use_cache` is True.
+    display_shape : tuple or None
+        [Optional. Default: None]
+        (height, width) in pixels at which the image will be displayed. If
+        given and `zoom` is 'auto', the zoom is chosen so that the tiles just
+        provide that resolution, taking into account the tile size of the
+        provider, instead of being derived from the extent alone.
+    max_tiles : int or None
+        [Optional. Default: None]
+        Maximum number of tiles to fetch. The planned tile grid is checked
+        against it before anything is downloaded.
+    max_bytes : int or None
+        [Optional. Default: None]
+        Maximum size in bytes of the returned image (4 bytes per pixel). The
+        planned tile grid is checked against it before anything is
+        downloaded.
+    budget_action : {'reduce', 'raise'}
+        [Optional. Default: 'reduce']
+        What to do when the planned tiles exceed `max_tiles` or `max_bytes`:
+        'reduce' lowers the zoom level (with a warning) until they fit,
+        'raise' raises a ValueError.
+    chunks : int or None
+        [Optional. Default: None]
+        If given, no tile is fetched right away and the image is returned as
+        a lazy ``xarray.DataArray`` backed by a dask array, with chunks of
+        `chunks` x `chunks` tiles. The tiles of a chunk are only fetched when
+        it is computed. The array has dimensions ('y', 'x', 'band'), the
+        coordinates of the pixel centres in Spherical Mercator and 'crs' and
+        'transform' attributes. Requires `dask` and `xarray`.
+    store : TileStore or None
+        [Optional. Default: None]
+        Store in which the tiles are cached (see `contextily.TileStore`),
+        instead of the default one in the cache directory (see
+        `set_cache_dir`). Ignored if `use_cache` is False.
+    decoded_cache : DecodedTileCache or None
+        [Optional. Default: None]
+        Cache of decoded tiles (see `contextily.DecodedTileCache`), from
+        which the tiles it holds are copied straight into the image, without
+        reading or decoding them. The other tiles are added to it once
+        fetched. Only used for web tiles.
 
     Returns
     -------
-    img : ndarray
-        Image as a 3D array of RGB values
+    img : ndarray or xarray.DataArray
+        Image as a 3D array of RGB values (lazy if `chunks` is given)
     extent : tuple
         Bounding box [minX, maxX, minY, maxY] of the returned image
     """
@@ -286,42 +471,469 @@ def bounds2img(
 
     # get provider dict given the url
     provider = _process_source(source)
+    grid, target_grid = _plan_tiles(
+        w, s, e, n, zoom, provider,
+        zoom_adjust=zoom_adjust,
+        overzoom=overzoom,
+        display_shape=display_shape,
+        max_tiles=max_tiles,
+        max_bytes=max_bytes,
+        budget_action=budget_action,
+    )
+    # download tiles
+    if n_connections < 1 or not isinstance(n_connections, int):
+        raise ValueError(f"n_connections must be a positive integer value.")
+    fetch_kwargs = dict(
+        wait=wait,
+        max_retries=max_retries,
+        headers=headers,
+        n_connections=n_connections,
+        use_cache=use_cache,
+        timeout=timeout,
+        pyramid_levels=pyramid_levels,
+        store=store,
+        decoded_cache=decoded_cache,
+    )
+    if chunks is not None:
+        return _lazy_mosaic(provider, target_grid, grid.z, chunks, **fetch_kwargs)
+    # download and merge tiles
+    merged, extent = _fetch_mosaic(provider, grid, **fetch_kwargs)
+    if target_grid is not grid:
+        merged, extent = _upsample_grid(merged, grid, target_grid)
+    return merged, extent
+
+
+def _plan_tiles(
+    w,
+    s,
+    e,
+    n,
+    zoom,
+    provider,
+    zoom_adjust=None,
+    overzoom=False,
+    display_shape=None,
+    max_tiles=None,
+    max_bytes=None,
+    budget_action="reduce",
+):
+    """
+    Resolve the zoom level for a lon/lat bounding box and plan the tiles to
+    fetch. See `bounds2img` for the parameters.
+
+    Returns
+    -------
+    grid : _TileGrid
+        Tiles to fetch.
+    target_grid : _TileGrid
+        Tiles of the output image, `grid` itself unless overzooming.
+    """
     # calculate and validate zoom level
     auto_zoom = zoom == "auto"
-    if auto_zoom:
+    if auto_zoom and display_shape is not None:
+        zoom = _calculate_display_zoom(
+            w, s, e, n, display_shape, tile_size=_tile_size(provider)
+        )
+    elif auto_zoom:
         zoom = _calculate_zoom(w, s, e, n)
     if zoom_adjust:
         zoom += zoom_adjust
-    zoom = _validate_zoom(zoom, provider, auto=auto_zoom)
-    # create list of tiles to download
-    tiles = list(mt.tiles(w, s, e, n, [zoom]))
-    tile_urls = [provider.build_url(x=tile.x, y=tile.y, z=tile.z) for tile in tiles]
-    # download tiles
-    if n_connections < 1 or not isinstance(n_connections, int):
-        raise ValueError(f"n_connections must be a positive integer value.")
-    # Use threads for a single connection to avoid the overhead of spawning a process. Use processes for multiple
-    # connections if caching is enabled, as threads lead to memory issues when used in combination with the joblib
-    # memory caching (used for the _fetch_tile() function).
-    preferred_backend = (
-        "threads" if (n_connections == 1 or not use_cache) else "processes"
+    zoom = _validate_zoom(zoom, provider, auto=auto_zoom, overzoom=overzoom)
+    # plan the grid of tiles to download, within the budget if any
+    grid, target_grid = _plan_grids(w, s, e, n, zoom, provider, overzoom)
+    if max_tiles is not None or max_bytes is not None:
+        grid, target_grid = _apply_budget(
+            w, s, e, n, grid, target_grid, provider, overzoom,
+            max_tiles, max_bytes, budget_action,
+        )
+    return grid, target_grid
+
+
+def _fetch_tiles(
+    provider,
+    z,
+    xs,
+    ys,
+    wait=0,
+    max_retries=2,
+    headers=None,
+    n_connections=1,
+    use_cache=True,
+    timeout=None,
+    pyramid_levels=0,
+    tiles=None,
+    store=None,
+):
+    """
+    Fetch the tiles `xs`, `ys` at zoom `z` from `provider` and return them
+    as a list of RGBA arrays. See `bounds2img` for the other parameters.
+
+    If `tiles` is given, it is a mapping of (z, x, y) to tile arrays already
+    in memory: those are reused and the tiles fetched are added to it.
+    """
+    from joblib import Parallel, delayed
+
+    if headers is None:
+        headers = {}
+    if tiles is not None:
+        keys = [(z, x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+        missing = [i for i, key in enumerate(keys) if key not in tiles]
+        if missing:
+            fetched = _fetch_tiles(
+                provider, z, xs[missing], ys[missing], wait, max_retries,
+                headers, n_connections, use_cache, timeout, pyramid_levels,
+                store=store,
+            )
+            for i, array in zip(missing, fetched):
+                if array is not None:
+                    tiles[keys[i]] = array
+        return [tiles.get(key) for key in keys]
+
+    if _is_archive_path(provider["url"]):
+        return _read_archive_tiles(provider["url"], z, xs, ys)
+    tile_urls = _build_urls(provider, z, xs, ys)
+    if _is_local_tiles(provider):
+        # Tiles on disk need neither the retry logic nor the cache, and reading
+        # them is I/O-bound, so read them concurrently with threads.
+        return Parallel(n_jobs=-1, prefer="threads")(
+            delayed(_read_local_tile)(tile_url) for tile_url in tile_urls
+        )
+    # Downloading is I/O-bound, so use threads. Tile stores are safe to use
+    # from concurrent threads.
+    store = _cache_store(use_cache, store)
+    contents = [None] * len(tile_urls)
+    arrays = [None] * len(tile_urls)
+    if store is not None:
+        contents = store.bulk_get(tile_urls)
+        missing = [i for i, content in enumerate(contents) if content is None]
+        if missing and pyramid_levels > 0:
+            built = _from_cached_children(
+                store, provider, z, xs[missing], ys[missing],
+                [tile_urls[i] for i in missing], pyramid_levels,
+            )
+            for i, array in zip(missing, built):
+                arrays[i] = array
+    # decode the cached tiles and download the others
+    todo = [i for i, array in enumerate(arrays) if array is None]
+    # a store in memory is only shared by threads, also if joblib is
+    # configured to use processes
+    require = "sharedmem" if isinstance(store, MemoryTileStore) else None
+    fetched = Parallel(n_jobs=n_connections, prefer="threads", require=require)(
+        delayed(_decode_tile)(contents[i])
+        if contents[i] is not None
+        else delayed(_fetch_tile)(
+            tile_urls[i], wait, max_retries, headers, timeout=timeout, store=store
+        )
+        for i in todo
+    )
+    for i, array in zip(todo, fetched):
+        arrays[i] = array
+    return arrays
+
+
+def _cache_store(use_cache, store=None):
+    """
+    Return the tile store to cache tiles in: `store`, or the default one in
+    the cache directory if None, or None if `use_cache` is False.
+    """
+    if not use_cache:
+        return None
+    return _get_store() if store is None else store
+
+
+def _fetch_mosaic(
+    provider,
+    grid,
+    wait=0,
+    max_retries=2,
+    headers=None,
+    n_connections=1,
+    use_cache=True,
+    timeout=None,
+    pyramid_levels=0,
+    store=None,
+    decoded_cache=None,
+):
+    """
+    Fetch the tiles of `grid` and merge them into a single image. Returns
+    the image and its extent, see `_merge_tiles`.
+    """
+    web = not _is_archive_path(provider["url"]) and not _is_local_tiles(provider)
+    if (
+        decoded_cache is not None
+        and web
+        and decoded_cache.tile_size == _tile_size(provider)
+    ):
+        return _fetch_mosaic_decoded(
+            provider, grid, decoded_cache, wait, max_retries, headers,
+            n_connections, use_cache, timeout, pyramid_levels, store,
+        )
+    if (
+        n_connections > 1
+        and use_cache
+        and _uses_processes()
+        and web
+        # only reachable from this process
+        and not isinstance(store, MemoryTileStore)
+    ):
+        # downloaded by worker processes, see _fetch_mosaic_shared
+        return _fetch_mosaic_shared(
+            provider, grid, wait, max_retries, headers, n_connections, timeout,
+            pyramid_levels, store,
+        )
+    xs, ys = _grid_xy(grid)
+    arrays = _fetch_tiles(
+        provider, grid.z, xs, ys, wait, max_retries, headers, n_connections,
+        use_cache, timeout, pyramid_levels, store=store,
     )
-    fetch_tile_fn = memory.cache(_fetch_tile) if use_cache else _fetch_tile
-    arrays = Parallel(n_jobs=n_connections, prefer=preferred_backend)(
-        delayed(fetch_tile_fn)(tile_url, wait, max_retries, headers, timeout=timeout) for tile_url in tile_urls
+    return _merge_tiles(grid, arrays)
+
+
+def _fetch_mosaic_decoded(
+    provider, grid, decoded_cache, wait, max_retries, headers, n_connections,
+    use_cache, timeout, pyramid_levels, store,
+):
+    """
+    Build the mosaic of `grid` by copying the tiles held by `decoded_cache`
+    directly into it, fetching only the others (which are then added to
+    `decoded_cache`).
+    """
+    size = decoded_cache.tile_size
+    xs, ys = _grid_xy(grid)
+    tile_urls = _build_urls(provider, grid.z, xs, ys)
+    mosaic = np.empty((grid.n_y * size, grid.n_x * size, 4), dtype=np.uint8)
+    missing = [
+        i
+        for i, tile_url in enumerate(tile_urls)
+        if not decoded_cache.get_into(
+            tile_url, mosaic[_tile_slice(i, grid.n_x, size)]
+        )
+    ]
+    if not missing:
+        return mosaic, _grid_extent(grid)
+    fetched = _fetch_tiles(
+        provider, grid.z, xs[missing], ys[missing], wait, max_retries, headers,
+        n_connections, use_cache, timeout, pyramid_levels, store=store,
     )
-    # merge downloaded tiles
-    merged, extent = _merge_tiles(tiles, arrays)
-    # lon/lat extent --> Spheric Mercator
-    west, south, east, north = extent
-    left, bottom = mt.xy(west, south)
-    right, top = mt.xy(east, north)
-    extent = left, right, bottom, top
-    return merged, extent
+    if any(array is None or array.shape != (size, size, 4) for array in fetched):
+        # tiles of an unexpected size, merged as usual
+        arrays = [mosaic[_tile_slice(i, grid.n_x, size)] for i in range(len(xs))]
+        for i, array in zip(missing, fetched):
+            arrays[i] = array
+        return _merge_tiles(grid, arrays)
+    for i, array in zip(missing, fetched):
+        mosaic[_tile_slice(i, grid.n_x, size)] = array
+        decoded_cache.put(tile_urls[i], array)
+    return mosaic, _grid_extent(grid)
+
+
+def _uses_processes():
+    """
+    Check if joblib is configured (e.g. with `joblib.parallel_config`) to use
+    a process-based backend, instead of the threads preferred for downloads.
+    """
+    from joblib.parallel import get_active_backend
+
+    backend, _ = get_active_backend(prefer="threads")
+    return not getattr(backend, "uses_threads", False)
+
+
+def _fetch_mosaic_shared(
+    provider, grid, wait, max_retries, headers, n_connections, timeout,
+    pyramid_levels, store=None,
+):
+    """
+    Download the tiles of `grid` with joblib worker processes that write the
+    decoded pixels directly into a shared memory mosaic, instead of sending
+    the tile arrays back to this process to be merged. Only used when joblib
+    is configured to use processes.
+    """
+    from multiprocessing import shared_memory
+
+    from joblib import Parallel, delayed
+
+    if headers is None:
+        headers = {}
+    xs, ys = _grid_xy(grid)
+    tile_urls = _build_urls(provider, grid.z, xs, ys)
+    store = _cache_store(True, store)
+    arrays = [None] * len(tile_urls)
+    if pyramid_levels > 0:
+        # tiles in the store are read by the workers
+        contents = store.bulk_get(tile_urls)
+        missing = [i for i, content in enumerate(contents) if content is None]
+        built = _from_cached_children(
+            store, provider, grid.z, xs[missing], ys[missing],
+            [tile_urls[i] for i in missing], pyramid_levels,
+        )
+        for i, array in zip(missing, built):
+            arrays[i] = array
+    size = _tile_size(provider)
+    shape = (grid.n_y * size, grid.n_x * size, 4)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+    mosaic = None
+    try:
+        mosaic = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        missing = [i for i, array in enumerate(arrays) if array is None]
+        results = Parallel(n_jobs=n_connections, prefer="processes")(
+            delayed(_fetch_tile_shared)(
+                store, tile_urls[i], shm.name, shape, size, i, wait,
+                max_retries, headers, timeout=timeout,
+            )
+            for i in missing
+        )
+        # tiles of an unexpected size (or that failed) are sent back instead
+        written = set()
+        for i, result in zip(missing, results):
+            if result is True:
+                written.add(i)
+            else:
+                arrays[i] = result
+        if all(
+            i in written or (array is not None and array.shape == (size, size, 4))
+            for i, array in enumerate(arrays)
+        ):
+            # add the tiles built from the cache, and copy out of shared memory
+            for i, array in enumerate(arrays):
+                if i not in written:
+                    mosaic[_tile_slice(i, grid.n_x, size)] = array
+            merged = mosaic.copy()
+        else:
+            for i in written:
+                arrays[i] = mosaic[_tile_slice(i, grid.n_x, size)].copy()
+            merged, _ = _merge_tiles(grid, arrays)
+    finally:
+        # release the buffer before closing the shared memory
+        mosaic = None
+        shm.close()
+        shm.unlink()
+    return merged, _grid_extent(grid)
+
+
+def _tile_slice(i, n_x, size):
+    """
+    Slice of the `i`-th tile (in row-major order) in a mosaic of `n_x`
+    columns of tiles of `size` pixels.
+    """
+    row, col = divmod(i, n_x)
+    return np.s_[size * row : size * (row + 1), size * col : size * (col + 1)]
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to the shared memory block `name`, owned (and unlinked) by
+    another process.
+    """
+    from multiprocessing import shared_memory
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # joblib workers share the resource tracker of the parent process, where
+    # the block is already registered (and unregistered when unlinked)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _fetch_tile_shared(
+    store, tile_url, shm_name, shape, size, position, wait, max_retries,
+    headers, timeout=None,
+):
+    """
+    Fetch a tile (through the tile `store`) and write it at `position`
+    (row-major index of the tile) in the mosaic of `shape`, made of tiles of
+    `size` pixels, in the shared memory block `shm_name`. Returns True, or
+    the tile array itself if it does not have the expected size.
+    """
+    array = _fetch_tile(
+        tile_url, wait, max_retries, headers, timeout=timeout, store=store
+    )
+    if array is None or array.shape != (size, size, shape[2]):
+        return array
+    shm = _attach_shared_memory(shm_name)
+    try:
+        mosaic = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        mosaic[_tile_slice(position, shape[1] // size, size)] = array
+        del mosaic
+    finally:
+        shm.close()
+    return True
+
+
+def _fetch_block(provider, grid, fetch_zoom, **kwargs):
+    """
+    Fetch and merge the tiles of `grid`, upsampled from the tiles at
+    `fetch_zoom` if it is lower than the zoom of `grid` (overzoom).
+    """
+    fetch_grid = grid if fetch_zoom == grid.z else _parent_grid(grid, fetch_zoom)
+    img, _ = _fetch_mosaic(provider, fetch_grid, **kwargs)
+    if fetch_grid is not grid:
+        img, _ = _upsample_grid(img, fetch_grid, grid)
+    return img
+
+
+def _lazy_mosaic(provider, grid, fetch_zoom, chunks, **kwargs):
+    """
+    Build a lazy, dask-backed ``xarray.DataArray`` of the image of `grid`,
+    with one chunk per block of `chunks` x `chunks` tiles. See `bounds2img`.
+    """
+    try:
+        import dask
+        import dask.array as da
+        import xarray as xr
+    except ImportError:
+        raise ImportError(
+            "Returning a lazy image (`chunks` argument) requires dask and xarray."
+        )
+    if chunks < 1 or not isinstance(chunks, int):
+        raise ValueError("chunks must be a positive integer value.")
+
+    tile_size = _tile_size(provider)
+    rows = []
+    for y in range(grid.y_min, grid.y_min + grid.n_y, chunks):
+        row = []
+        for x in range(grid.x_min, grid.x_min + grid.n_x, chunks):
+            block = _TileGrid(
+                grid.z,
+                x,
+                y,
+                min(chunks, grid.x_min + grid.n_x - x),
+                min(chunks, grid.y_min + grid.n_y - y),
+            )
+            task = dask.delayed(_fetch_block, pure=True)(
+                provider, block, fetch_zoom, **kwargs
+            )
+            shape = (block.n_y * tile_size, block.n_x * tile_size, 4)
+            row.append(da.from_delayed(task, shape=shape, dtype=np.uint8))
+        rows.append(da.concatenate(row, axis=1))
+    data = da.concatenate(rows, axis=0)
+
+    extent = _grid_extent(grid)
+    minX, maxX, minY, maxY = extent
+    res_x = (maxX - minX) / data.shape[1]
+    res_y = (maxY - minY) / data.shape[0]
+    img = xr.DataArray(
+        data,
+        dims=("y", "x", "band"),
+        coords={
+            "y": maxY - (np.arange(data.shape[0]) + 0.5) * res_y,
+            "x": minX + (np.arange(data.shape[1]) + 0.5) * res_x,
+            "band": np.arange(1, 5),
+        },
+        attrs={
+            "crs": "EPSG:3857",
+            "transform": (res_x, 0.0, minX, 0.0, -res_y, maxY),
+        },
+    )
+    return img, extent
 
 
 def _process_source(source):
+    from xyzservices import TileProvider
+    from . import providers
+
     if source is None:
         provider = providers.OpenStreetMap.HOT
+    elif _is_archive_path(source):
+        provider = _archive_provider(source)
     elif isinstance(source, str):
         provider = TileProvider(url=source, attribution="", name="url")
     elif not isinstance(source, dict):
@@ -335,12 +947,214 @@ def _process_source(source):
     return provider
 
 
-def _fetch_tile(tile_url, wait, max_retries, headers: dict[str, str], timeout=None):
-    array = _retryer(tile_url, wait, max_retries, headers, timeout=timeout)
-    return array
+def _archive_provider(path):
+    """
+    Build a provider for a tile archive from the metadata it stores.
+    """
+    from xyzservices import TileProvider
+
+    archive = open_archive(path)
+    provider = TileProvider(
+        url=path,
+        attribution=archive.metadata.get("attribution", ""),
+        name=archive.metadata.get("name", "archive"),
+        min_zoom=archive.min_zoom,
+    )
+    if archive.max_zoom is not None:
+        provider["max_zoom"] = archive.max_zoom
+    return provider
+
+
+def _read_archive_tiles(path, z, xs, ys):
+    """
+    Read and decode a batch of tiles of zoom level `z` from an archive.
+    """
+    contents = open_archive(path).read_tiles(z, xs, ys)
+    for x, y, content in zip(xs, ys, contents):
+        if content is None:
+            raise ValueError(
+                "Tile {0}/{1}/{2} is not available in the archive {3}. Try a "
+                "zoom level or extent covered by the archive.".format(z, x, y, path)
+            )
+    from joblib import Parallel, delayed
+
+    return Parallel(n_jobs=-1, prefer="threads")(
+        delayed(_decode_tile)(content) for content in contents
+    )
+
+
+def _decode_tile(content):
+    """
+    Decode an encoded tile image (e.g. PNG or JPEG bytes) into an RGBA array.
+    """
+    from PIL import Image
+
+    with io.BytesIO(content) as image_stream:
+        with Image.open(image_stream) as image:
+            return np.asarray(image.convert("RGBA"))
 
 
-def warp_tiles(img, extent, t_crs="EPSG:4326", resampling=Resampling.bilinear):
+def _is_local_tiles(provider):
+    """
+    Check if the provider points to a tile tree on the local file system
+    (i.e. its URL is a ``file://`` template).
+    """
+    return provider.get("url", "").startswith("file://")
+
+
+def _read_local_tile(tile_url):
+    """
+    Read a tile from a ``file://`` URL and return it as an RGBA array.
+    """
+    from PIL import Image
+
+    path = url2pathname(urlparse(tile_url).path)
+    try:
+        with Image.open(path) as image:
+            return np.asarray(image.convert("RGBA"))
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            "Tile file does not exist. "
+            "Double-check your tile url:\n{}".format(tile_url)
+        )
+
+
+def _from_cached_children(store, provider, z, xs, ys, tile_urls, levels):
+    """
+    Build tiles missing from the cache by downsampling their cached
+    children at up to `levels` higher zoom levels. The tiles built are
+    added to the cache.
+
+    Parameters
+    ----------
+    store : TileStore
+        Store of the cached tiles.
+    provider : TileProvider
+    z : int
+        Zoom level of the tiles.
+    xs, ys : ndarray
+        Tile indices.
+    tile_urls : list of str
+        URLs of the tiles.
+    levels : int
+        Maximum number of zoom levels to look up.
+
+    Returns
+    -------
+    list of ndarray or None
+        The tiles built from their children, None for tiles for which not
+        all children are cached.
+    """
+    max_zoom = provider.get("max_zoom", z + levels)
+    arrays = []
+    for x, y, tile_url in zip(xs.tolist(), ys.tolist(), tile_urls):
+        array = None
+        for level in range(1, min(levels, max_zoom - z) + 1):
+            factor = 2**level
+            children = _TileGrid(z + level, x * factor, y * factor, factor, factor)
+            child_xs, child_ys = _grid_xy(children)
+            child_urls = _build_urls(provider, children.z, child_xs, child_ys)
+            contents = store.bulk_get(child_urls)
+            if all(content is not None for content in contents):
+                merged, _ = _merge_tiles(
+                    children, [_decode_tile(content) for content in contents]
+                )
+                array = _reduce_image(merged, factor)
+                # reused as is by the next requests at this zoom level
+                store.put(tile_url, _encode_tile(array))
+                break
+        arrays.append(array)
+    return arrays
+
+
+def _encode_tile(array):
+    """
+    Encode a tile array as PNG bytes, e.g. to store a tile built locally.
+    """
+    from PIL import Image
+
+    with io.BytesIO() as buf:
+        with Image.fromarray(array) as image:
+            image.save(buf, format="PNG")
+        return buf.getvalue()
+
+
+def _reduce_image(img, factor):
+    """
+    Downsample an image by an integer `factor`, averaging each block of
+    `factor` x `factor` pixels.
+    """
+    from PIL import Image
+
+    with Image.fromarray(img) as image:
+        return np.asarray(image.reduce(factor))
+
+
+def _fetch_tile(
+    tile_url, wait, max_retries, headers: dict[str, str], timeout=None, store=None
+):
+    """
+    Fetch a tile, from the tile `store` if it is cached there. Downloaded
+    tiles are added to the `store`. A tile that is already being downloaded
+    by another thread is waited for instead of being requested again.
+    """
+    if store is not None:
+        content = store.get(tile_url)
+        if content is not None:
+            return _decode_tile(content)
+
+    def download():
+        if store is not None:
+            # cached by a download that finished since the lookup above
+            content = store.get(tile_url)
+            if content is not None:
+                return _decode_tile(content)
+        content, array = _download_decoded(
+            tile_url, wait, max_retries, headers, timeout=timeout
+        )
+        if store is not None:
+            store.put(tile_url, content)
+        return array
+
+    # keyed apart from the downloads of encoded tiles, e.g. by the proxy
+    return _single_flight(("array", tile_url), download)
+
+
+# downloads in progress in this process, by kind of result and tile URL
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _single_flight(key, func):
+    """
+    Call `func` and return its result, unless a call for the same `key` is
+    already running in another thread, in which case its result (or error)
+    is awaited and returned instead. Callers returning different kinds of
+    results must use different keys.
+    """
+    from concurrent.futures import Future
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+    if not leader:
+        return future.result()
+    try:
+        result = func()
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+    return result
+
+
+def warp_tiles(img, extent, t_crs="EPSG:4326", resampling=None):
     """
     Reproject (warp) a Web Mercator basemap into any CRS on-the-fly
 
@@ -358,10 +1172,10 @@ def warp_tiles(img, extent, t_crs="EPSG:4326", resampling=Resampling.bilinear):
     t_crs : str/CRS
         [Optional. Default='EPSG:4326'] Target CRS, expressed in any
         format permitted by rasterio. Defaults to WGS84 (lon/lat)
-    resampling : <enum 'Resampling'>
-        [Optional. Default=Resampling.bilinear] Resampling method for
-        executing warping, expressed as a `rasterio.enums.Resampling`
-        method
+    resampling : <enum 'Resampling'> or None
+        [Optional. Default=None] Resampling method for executing warping,
+        expressed as a `rasterio.enums.Resampling` method. None means
+        `Resampling.bilinear`.
 
     Returns
     -------
@@ -372,6 +1186,8 @@ def warp_tiles(img, extent, t_crs="EPSG:4326", resampling=Resampling.bilinear):
         Bounding box [minX, maxX, minY, maxY] of the returned (warped)
         image
     """
+    from rasterio.transform import from_origin
+
     h, w, b = img.shape
     # --- https://rasterio.readthedocs.io/en/latest/quickstart.html#opening-a-dataset-in-writing-mode
     minX, maxX, minY, maxY = extent
@@ -389,7 +1205,7 @@ def warp_tiles(img, extent, t_crs="EPSG:4326", resampling=Resampling.bilinear):
     return w_img.transpose(1, 2, 0), extent
 
 
-def warp_img_transform(img, transform, s_crs, t_crs, resampling=Resampling.bilinear):
+def warp_img_transform(img, transform, s_crs, t_crs, resampling=None):
     """
     Reproject (warp) an `img` with a given `transform` and `s_crs` into a
     different `t_crs`
@@ -410,10 +1226,10 @@ def warp_img_transform(img, transform, s_crs, t_crs, resampling=Resampling.bilin
         permitted by rasterio.
     t_crs : str/CRS
         Target CRS, expressed in any format permitted by rasterio.
-    resampling : <enum 'Resampling'>
-        [Optional. Default=Resampling.bilinear] Resampling method for
-        executing warping, expressed as a `rasterio.enums.Resampling`
-        method
+    resampling : <enum 'Resampling'> or None
+        [Optional. Default=None] Resampling method for executing warping,
+        expressed as a `rasterio.enums.Resampling` method. None means
+        `Resampling.bilinear`.
 
     Returns
     -------
@@ -432,6 +1248,12 @@ def _warper(img, transform, s_crs, t_crs, resampling):
     """
     Warp an image. Returns the warped image and updated bounds and transform.
     """
+    from rasterio.enums import Resampling
+    from rasterio.io import MemoryFile
+    from rasterio.vrt import WarpedVRT
+
+    if resampling is None:
+        resampling = Resampling.bilinear
     b, h, w = img.shape
     with MemoryFile() as memfile:
         with memfile.open(
@@ -480,30 +1302,72 @@ def _retryer(tile_url, wait, max_retries, headers: dict[str, str], timeout=None)
     -------
     array of the tile
     """
+    return _download_decoded(tile_url, wait, max_retries, headers, timeout=timeout)[1]
+
+
+def _download_decoded(tile_url, wait, max_retries, headers, timeout=None):
+    """
+    Download and decode a tile, retrying as described in `_retryer`, also
+    when the content downloaded is not an image. Returns both the encoded
+    content of the tile and its array.
+    """
+    import requests
+    from PIL import UnidentifiedImageError
+
+    content = _download_tile(tile_url, wait, max_retries, headers, timeout=timeout)
     try:
-        request = requests.get(
+        return content, _decode_tile(content)
+    except UnidentifiedImageError:
+        if max_retries > 0:
+            time.sleep(wait)
+            return _download_decoded(
+                tile_url, wait, max_retries - 1, headers, timeout=timeout
+            )
+        raise requests.HTTPError(
+            "Connection reset by peer too many times. "
+            f"Last content was not an image for url: {tile_url}"
+        )
+
+
+def _download_tile(
+    tile_url, wait, max_retries, headers, timeout=None, session=None,
+    before_request=None,
+):
+    """
+    Download a tile, retrying failed requests as described in `_retryer`,
+    with the `requests.Session` `session` if given. `before_request` is
+    called (without arguments) before each request, including the retries,
+    e.g. to rate limit them. Returns the encoded content of the tile, as
+    is: see `_download_decoded` to decode it.
+    """
+    import requests
+
+    get = requests.get if session is None else session.get
+    if before_request is not None:
+        before_request()
+    try:
+        request = get(
             tile_url, 
             headers={"user-agent": USER_AGENT, **headers},
             timeout=timeout)
         request.raise_for_status()
-        with io.BytesIO(request.content) as image_stream:
-            image = Image.open(image_stream).convert("RGBA")
-            array = np.asarray(image)
-            image.close()
-
-            return array
+        return request.content
 
-    except (requests.HTTPError, UnidentifiedImageError):
+    except requests.HTTPError:
         if request.status_code == 404:
             raise requests.HTTPError(
                 "Tile URL resulted in a 404 error. "
-                "Double-check your tile url:\n{}".format(tile_url)
+                "Double-check your tile url:\n{}".format(tile_url),
+                response=request,
             )
         else:
             if max_retries > 0:
                 time.sleep(wait)
                 max_retries -= 1
-                return _retryer(tile_url, wait, max_retries, headers, timeout=timeout)
+                return _download_tile(
+                    tile_url, wait, max_retries, headers, timeout=timeout,
+                    session=session, before_request=before_request,
+                )
             else:
                 raise requests.HTTPError("Connection reset by peer too many times. "
                                          f"Last message was: {request.status_code} "
@@ -513,17 +1377,23 @@ def howmany(w, s, e, n, zoom, verbose=True, ll=False):
     """
     Number of tiles required for a given bounding box and a zoom level
 
+    The count is computed in closed form from the range of tile indices
+    covering the bounding box, so it is cheap even for high zoom levels over
+    large areas. All arguments can also be arrays, which are broadcast against
+    each other, e.g. to count tiles for many bounding boxes at once, or for a
+    range of zoom levels by passing ``zoom=np.arange(10, 15)[:, None]``.
+
     Parameters
     ----------
-    w : float
+    w : float or array_like
         West edge
-    s : float
+    s : float or array_like
         South edge
-    e : float
+    e : float or array_like
         East edge
-    n : float
+    n : float or array_like
         North edge
-    zoom : int
+    zoom : int, array_like or 'auto'
         Level of detail
     verbose : Boolean
         [Optional. Default=True] If True, print short message with
@@ -531,19 +1401,293 @@ def howmany(w, s, e, n, zoom, verbose=True, ll=False):
     ll : Boolean
         [Optional. Default: False] If True, `w`, `s`, `e`, `n` are
         assumed to be lon/lat as opposed to Spherical Mercator.
+
+    Returns
+    -------
+    int or ndarray
+        Number of tiles, with the broadcast shape of the inputs when
+        arrays are passed.
     """
     if not ll:
         # Convert w, s, e, n into lon/lat
         w, s = _sm2ll(w, s)
         e, n = _sm2ll(e, n)
-    if zoom == "auto":
+    if isinstance(zoom, str) and zoom == "auto":
         zoom = _calculate_zoom(w, s, e, n)
-    tiles = len(list(mt.tiles(w, s, e, n, [zoom])))
-    if verbose:
-        print("Using zoom level %i, this will download %i tiles" % (zoom, tiles))
+    x_min, x_max, y_min, y_max = _tile_ranges(w, s, e, n, zoom)
+    tiles = (x_max - x_min + 1) * (y_max - y_min + 1)
+    if np.ndim(tiles) == 0:
+        tiles = int(tiles)
+        if verbose:
+            print("Using zoom level %i, this will download %i tiles" % (zoom, tiles))
+    elif verbose:
+        print("This will download %i tiles in total" % tiles.sum())
     return tiles
 
 
+def estimate_download(w, s, e, n, zoom, source=None, ll=False, tile_bytes=None):
+    """
+    Estimate the number of tiles and bytes to download for a bounding box
+    and a zoom level, without downloading anything.
+
+    Useful as a cheap capacity-planning check before fetching a basemap.
+    Like `howmany`, all arguments can be arrays, which are broadcast against
+    each other.
+
+    Parameters
+    ----------
+    w : float or array_like
+        West edge
+    s : float or array_like
+        South edge
+    e : float or array_like
+        East edge
+    n : float or array_like
+        North edge
+    zoom : int, array_like or 'auto'
+        Level of detail
+    source : xyzservices.TileProvider object or str
+        [Optional. Default: OpenStreetMap Humanitarian web tiles]
+        The tile source, used to get the size of its tiles.
+    ll : Boolean
+        [Optional. Default: False] If True, `w`, `s`, `e`, `n` are
+        assumed to be lon/lat as opposed to Spherical Mercator.
+    tile_bytes : int or None
+        [Optional. Default: None] Typical size in bytes of a tile of
+        `source`. If None, `TILE_BYTES` scaled to the tile size (in pixels)
+        of the provider is used.
+
+    Returns
+    -------
+    n_tiles : int or ndarray
+        Number of tiles
+    n_bytes : int or ndarray
+        Estimated download size, in bytes
+    """
+    provider = _process_source(source)
+    if tile_bytes is None:
+        tile_bytes = TILE_BYTES * (_tile_size(provider) / 256) ** 2
+    n_tiles = howmany(w, s, e, n, zoom, verbose=False, ll=ll)
+    n_bytes = np.multiply(n_tiles, tile_bytes).astype(np.int64)
+    if np.ndim(n_bytes) == 0:
+        n_bytes = int(n_bytes)
+    return n_tiles, n_bytes
+
+
+def _tile_size(provider):
+    """
+    Size in pixels of the (square) tiles of a provider.
+    """
+    return int(provider.get("tileSize", 256))
+
+
+def _lonlat2tile(lon, lat, zoom):
+    """
+    Vectorized version of `mercantile.tile`, returning the x and y indices
+    of the tiles containing lon/lat points.
+
+    Longitudes are not wrapped, so that a longitude beyond 180 (or -180)
+    gives a column index past the last (or before the first) column.
+    """
+    x = np.asarray(lon) / 360.0 + 0.5
+    sinlat = np.sin(np.radians(lat))
+    y = 0.5 - 0.25 * np.log((1.0 + sinlat) / (1.0 - sinlat)) / np.pi
+    z2 = 2.0 ** np.asarray(zoom)
+    # points within EPSILON of the right side of a tile go to the next one
+    xtile = np.floor((x + mt.EPSILON) * z2).astype(np.int64)
+    ytile = np.clip(np.floor((y + mt.EPSILON) * z2), 0, z2 - 1).astype(np.int64)
+    return xtile, ytile
+
+
+def _tile_ranges(w, s, e, n, zoom):
+    """
+    Range of tile indices covering lon/lat bounding boxes.
+
+    This is a closed-form, vectorized equivalent of `mercantile.tiles`: the
+    tiles covering a bounding box are those with ``x_min <= x <= x_max`` and
+    ``y_min <= y <= y_max``.
+
+    Column indices are unwrapped, so that bounding boxes crossing the
+    antimeridian are covered by a single contiguous range of columns: either
+    with ``w > e`` (e.g. 170 to -170), where `x_max` goes past the last
+    column (``>= 2**zoom``), or with longitudes beyond +/-180 (e.g. 170 to
+    190, or -190 to -170), where the range extends past the last or before
+    the first column. Indices are taken modulo ``2**zoom`` to get the
+    actual tiles. Bounding boxes 360 degrees wide or wider (e.g. a world map
+    with margins) do not cross the antimeridian, and are clamped to the
+    whole world.
+
+    Returns
+    -------
+    x_min, x_max, y_min, y_max : ndarray or int
+        Inclusive tile index ranges.
+    """
+    z2 = 2 ** np.asarray(zoom, dtype=np.int64)
+    e = np.where(np.asarray(w) > np.asarray(e), np.add(e, 360.0), e)
+    s = np.maximum(-85.051129, s)
+    n = np.minimum(85.051129, n)
+    x_min, y_min = _lonlat2tile(w, n, zoom)
+    x_max, y_max = _lonlat2tile(e - mt.LL_EPSILON, s + mt.LL_EPSILON, zoom)
+    # never cover more than the whole world
+    world = np.subtract(e, w) >= 360.0
+    x_min = np.where(world, 0, x_min)
+    x_max = np.where(world, z2 - 1, x_max)
+    return x_min, x_max, y_min, y_max
+
+
+# A rectangular block of tiles of zoom level `z`, with its upper left tile at
+# (`x_min`, `y_min`) and `n_x` columns by `n_y` rows. Columns are unwrapped,
+# i.e. `x_min + n_x` can go past the antimeridian (`2**z`).
+_TileGrid = namedtuple("_TileGrid", ["z", "x_min", "y_min", "n_x", "n_y"])
+
+
+def _tile_grid(w, s, e, n, zoom):
+    """
+    Plan the grid of tiles of zoom level `zoom` covering a lon/lat bounding
+    box.
+    """
+    x_min, x_max, y_min, y_max = _tile_ranges(w, s, e, n, zoom)
+    return _TileGrid(
+        int(zoom), int(x_min), int(y_min), int(x_max - x_min + 1), int(y_max - y_min + 1)
+    )
+
+
+def _plan_grids(w, s, e, n, zoom, provider, overzoom=False):
+    """
+    Plan the tiles for a lon/lat bounding box at `zoom`. Returns the grid of
+    tiles to fetch and the grid of the output image, which differ only when
+    overzooming beyond the max zoom of `provider`.
+    """
+    target_grid = _tile_grid(w, s, e, n, zoom)
+    grid = target_grid
+    if overzoom and zoom > provider.get("max_zoom", zoom):
+        # fetch the (fewer) tiles at the max zoom covering the same area
+        grid = _parent_grid(target_grid, provider["max_zoom"])
+    return grid, target_grid
+
+
+def _budget_excess(grid, target_grid, provider, max_tiles=None, max_bytes=None):
+    """
+    Describe how the planned grids exceed the tile and memory budgets, or
+    return None if they fit.
+    """
+    n_tiles = grid.n_x * grid.n_y
+    # decoded RGBA image, at the resolution of the output grid
+    n_bytes = target_grid.n_x * target_grid.n_y * _tile_size(provider) ** 2 * 4
+    excess = []
+    if max_tiles is not None and n_tiles > max_tiles:
+        excess.append("{} tiles (max_tiles={})".format(n_tiles, max_tiles))
+    if max_bytes is not None and n_bytes > max_bytes:
+        excess.append("{} bytes (max_bytes={})".format(n_bytes, max_bytes))
+    return " and ".join(excess) or None
+
+
+def _apply_budget(
+    w, s, e, n, grid, target_grid, provider, overzoom, max_tiles, max_bytes,
+    budget_action,
+):
+    """
+    Check the planned grids against `max_tiles` and `max_bytes`, stepping
+    the zoom level down until they fit if `budget_action` is 'reduce'.
+    """
+    if budget_action not in ("reduce", "raise"):
+        raise ValueError(
+            "budget_action must be 'reduce' or 'raise', got {!r}".format(budget_action)
+        )
+    zoom = target_grid.z
+    excess = _budget_excess(grid, target_grid, provider, max_tiles, max_bytes)
+    if excess is None:
+        return grid, target_grid
+    min_zoom = provider.get("min_zoom", 0)
+    while excess is not None and budget_action == "reduce" and zoom > min_zoom:
+        zoom -= 1
+        grid, target_grid = _plan_grids(w, s, e, n, zoom, provider, overzoom)
+        excess = _budget_excess(grid, target_grid, provider, max_tiles, max_bytes)
+    if excess is not None:
+        raise ValueError(
+            "The tiles planned at zoom level {} need {}, exceeding the budget. "
+            "Use a lower zoom level, check the extent (and its coordinate "
+            "reference system) or raise the budget.".format(zoom, excess)
+        )
+    warnings.warn(
+        "The zoom level was reduced to {} to stay within the tile budget".format(zoom)
+    )
+    return grid, target_grid
+
+
+def _grid_xy(grid):
+    """
+    Tile indices of all the tiles of a grid, in row-major order and wrapped
+    around the antimeridian.
+
+    Returns
+    -------
+    xs, ys : ndarray
+        Column and row of each tile.
+    """
+    ys, xs = np.divmod(np.arange(grid.n_x * grid.n_y), grid.n_x)
+    return (xs + grid.x_min) % 2**grid.z, ys + grid.y_min
+
+
+def _grid_extent(grid):
+    """
+    Bounding box [minX, maxX, minY, maxY] of a grid of tiles in Spherical
+    Mercator.
+    """
+    tile_length = 2 * _ORIGIN_SHIFT / 2**grid.z
+    left = -_ORIGIN_SHIFT + grid.x_min * tile_length
+    top = _ORIGIN_SHIFT - grid.y_min * tile_length
+    return (
+        left,
+        left + grid.n_x * tile_length,
+        top - grid.n_y * tile_length,
+        top,
+    )
+
+
+def _parent_grid(grid, zoom):
+    """
+    Grid of tiles of the lower zoom level `zoom` covering `grid`.
+    """
+    factor = 2 ** (grid.z - zoom)
+    x_min, y_min = grid.x_min // factor, grid.y_min // factor
+    x_max = (grid.x_min + grid.n_x - 1) // factor
+    y_max = (grid.y_min + grid.n_y - 1) // factor
+    return _TileGrid(zoom, x_min, y_min, x_max - x_min + 1, y_max - y_min + 1)
+
+
+def _upsample_grid(img, grid, target_grid):
+    """
+    Upsample the merged image of `grid` to the pixel density of the higher
+    zoom `target_grid` it covers, cropped to the extent of `target_grid`.
+    """
+    from PIL import Image
+
+    factor = 2 ** (target_grid.z - grid.z)
+    tile_h, tile_w = img.shape[0] // grid.n_y, img.shape[1] // grid.n_x
+    # position of the target grid in pixels of the source image
+    box = (
+        (target_grid.x_min / factor - grid.x_min) * tile_w,
+        (target_grid.y_min / factor - grid.y_min) * tile_h,
+        ((target_grid.x_min + target_grid.n_x) / factor - grid.x_min) * tile_w,
+        ((target_grid.y_min + target_grid.n_y) / factor - grid.y_min) * tile_h,
+    )
+    size = (target_grid.n_x * tile_w, target_grid.n_y * tile_h)
+    with Image.fromarray(img) as image:
+        resized = image.resize(size, resample=Image.Resampling.BILINEAR, box=box)
+        return np.asarray(resized), _grid_extent(target_grid)
+
+
+def _build_urls(provider, z, xs, ys):
+    """
+    Build the URLs of a batch of tiles of zoom level `z`.
+    """
+    # fill everything but the tile indices once, and only format x and y per
+    # tile
+    template = provider.build_url(z=z)
+    return [template.format(x=x, y=y) for x, y in zip(xs.tolist(), ys.tolist())]
+
+
 def bb2wdw(bb, rtr):
     """
     Convert XY bounding box into the window of the tile raster
@@ -606,35 +1750,75 @@ def _calculate_zoom(w, s, e, n):
 
     Parameters
     ----------
-    w : float
+    w : float or array_like
         The western bbox edge.
-    s : float
+    s : float or array_like
         The southern bbox edge.
-    e : float
+    e : float or array_like
         The eastern bbox edge.
-    n : float
+    n : float or array_like
         The northern bbox edge.
 
     Returns
     -------
-    zoom : int
+    zoom : int or ndarray
         The zoom level to use in order to download this number of tiles.
     """
-    # Calculate bounds of the bbox
-    lon_range = np.sort([e, w])[::-1]
-    lat_range = np.sort([s, n])[::-1]
-
-    lon_length = np.subtract(*lon_range)
-    lat_length = np.subtract(*lat_range)
+    # Calculate bounds of the bbox (crossing the antimeridian if w > e)
+    lon_length = np.subtract(e, w)
+    lon_length = np.where(lon_length < 0, lon_length + 360, lon_length)
+    lat_length = np.abs(np.subtract(n, s))
 
     # Calculate the zoom
     zoom_lon = np.ceil(np.log2(360 * 2.0 / lon_length))
     zoom_lat = np.ceil(np.log2(360 * 2.0 / lat_length))
-    zoom = np.min([zoom_lon, zoom_lat])
-    return int(zoom)
+    zoom = np.minimum(zoom_lon, zoom_lat)
+    if np.ndim(zoom) == 0:
+        return int(zoom)
+    return zoom.astype(int)
+
+
+def _calculate_display_zoom(w, s, e, n, shape, tile_size=256):
+    """Choose the lowest zoom level whose tiles have at least the resolution
+    of an image of a given size covering the bbox.
+
+    .. note:: all values are interpreted as latitude / longitude.
 
+    Parameters
+    ----------
+    w : float
+        The western bbox edge.
+    s : float
+        The southern bbox edge.
+    e : float
+        The eastern bbox edge.
+    n : float
+        The northern bbox edge.
+    shape : tuple
+        (height, width) in pixels of the image displaying the bbox.
+    tile_size : int
+        Size in pixels of the tiles.
 
-def _validate_zoom(zoom, provider, auto=True):
+    Returns
+    -------
+    zoom : int
+        The zoom level to use in order to fill the image.
+    """
+    height, width = shape
+    # extent of the bbox as fractions of the width of the (square) world in
+    # Spherical Mercator
+    lon_length = e - w if e > w else e - w + 360
+    x_fraction = lon_length / 360
+    n, s = np.radians(np.clip([n, s], -85.051129, 85.051129))
+    y_fraction = abs(np.arctanh(np.sin(n)) - np.arctanh(np.sin(s))) / (2 * np.pi)
+    # number of pixels across the world needed to display the bbox
+    world_pixels = max(width / x_fraction, height / y_fraction)
+    # tolerance so that an extent of exactly one tile does not round up
+    zoom = np.ceil(np.log2(world_pixels / tile_size) - 1e-9)
+    return max(int(zoom), 0)
+
+
+def _validate_zoom(zoom, provider, auto=True, overzoom=False):
     """
     Validate the zoom level and if needed raise informative error message.
     Returns the validated zoom.
@@ -647,6 +1831,9 @@ def _validate_zoom(zoom, provider, auto=True):
     auto : bool
         Indicating if zoom was specified or calculated (to have specific
         error message for each case).
+    overzoom : bool
+        If True, zoom levels above a known max zoom of the provider are
+        valid (tiles are then upsampled from the max zoom).
 
     Returns
     -------
@@ -665,6 +1852,8 @@ def _validate_zoom(zoom, provider, auto=True):
 
     if min_zoom <= zoom <= max_zoom:
         return zoom
+    if overzoom and max_zoom_known and zoom > max_zoom:
+        return zoom
 
     mode = "inferred" if auto else "specified"
     msg = "The {0} zoom level of {1} is not valid for the current tile provider".format(
@@ -687,32 +1876,26 @@ def _validate_zoom(zoom, provider, auto=True):
     raise ValueError(msg)
 
 
-def _merge_tiles(tiles, arrays):
+def _merge_tiles(grid, arrays):
     """
-    Merge a set of tiles into a single array.
+    Merge a grid of tiles into a single array.
 
     Parameters
     ---------
-    tiles : list of mercantile.Tile objects
-        The tiles to merge.
+    grid : _TileGrid
+        The grid of tiles to merge.
     arrays : list of numpy arrays
-        The corresponding arrays (image pixels) of the tiles. This list
-        has the same length and order as the `tiles` argument.
+        The corresponding arrays (image pixels) of the tiles, in the
+        row-major order of the grid (see `_grid_xy`).
 
     Returns
     -------
     img : np.ndarray
         Merged arrays.
     extent : tuple
-        Bounding box [west, south, east, north] of the returned image
-        in long/lat.
+        Bounding box [minX, maxX, minY, maxY] of the returned image
+        in Spherical Mercator.
     """
-    # create (n_tiles x 2) array with column for x and y coordinates
-    tile_xys = np.array([(t.x, t.y) for t in tiles])
-
-    # get indices starting at zero
-    indices = tile_xys - tile_xys.min(axis=0)
-
     # guard against tiles that failed to download (see GH#252)
     if any(arr is None for arr in arrays):
         raise ValueError(
@@ -724,22 +1907,11 @@ def _merge_tiles(tiles, arrays):
     # the shape of individual tile images
     h, w, d = arrays[0].shape
 
-    # number of rows and columns in the merged tile
-    n_x, n_y = (indices + 1).max(axis=0)
-
     # empty merged tiles array to be filled in
-    img = np.zeros((h * n_y, w * n_x, d), dtype=np.uint8)
+    img = np.zeros((h * grid.n_y, w * grid.n_x, d), dtype=np.uint8)
 
-    for ind, arr in zip(indices, arrays):
-        x, y = ind
+    for i, arr in enumerate(arrays):
+        y, x = divmod(i, grid.n_x)
         img[y * h : (y + 1) * h, x * w : (x + 1) * w, :] = arr
 
-    bounds = np.array([mt.bounds(t) for t in tiles])
-    west, south, east, north = (
-        min(bounds[:, 0]),
-        min(bounds[:, 1]),
-        max(bounds[:, 2]),
-        max(bounds[:, 3]),
-    )
-
-    return img, (west, south, east, north)
+    return img, _grid_extent(grid)
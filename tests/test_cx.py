@@ -1,6 +1,7 @@
 import matplotlib
 
 matplotlib.use("agg")  # To prevent plots from using display
+import matplotlib.pyplot
 import contextily as cx
 import os
 import numpy as np
@@ -12,6 +13,7 @@ from contextily.tile import _calculate_zoom, _merge_tiles, _retryer
 from numpy.testing import assert_array_almost_equal
 from unittest.mock import patch, MagicMock
 import io
+import warnings
 from PIL import Image
 import geopy
 
@@ -546,6 +548,42 @@ def test_howmany():
     assert got == expected
 
 
+def test_howmany_vectorized():
+    rng = np.random.default_rng(0)
+    w = rng.uniform(-180, 170, 50)
+    e = w + rng.uniform(0.001, 10, 50)
+    s = rng.uniform(-89, 80, 50)
+    n = s + rng.uniform(0.001, 9, 50)
+    zooms = np.arange(0, 12)[:, None]
+    got = cx.howmany(w, s, e, n, zooms, verbose=False, ll=True)
+    assert got.shape == (12, 50)
+    for i, zoom in enumerate(zooms[:, 0]):
+        expected = [
+            len(list(mt.tiles(*bbox, [int(zoom)]))) for bbox in zip(w, s, e, n)
+        ]
+        np.testing.assert_array_equal(got[i], expected)
+
+    # high zooms over large areas are counted without enumerating tiles
+    ul, lr = mt.tile(-10, 10, 20), mt.tile(10, -10, 20)
+    expected = (lr.x - ul.x + 1) * (lr.y - ul.y + 1)
+    assert cx.howmany(-10, -10, 10, 10, 20, verbose=False, ll=True) == expected
+
+
+def test_estimate_download():
+    n_tiles, n_bytes = cx.estimate_download(
+        -10, -10, 10, 10, [4, 5], ll=True, tile_bytes=1000
+    )
+    np.testing.assert_array_equal(n_tiles, [4, 4])
+    np.testing.assert_array_equal(n_bytes, [4000, 4000])
+
+    # 512px tiles are assumed four times as large as 256px ones
+    n_tiles, n_bytes = cx.estimate_download(-10, -10, 10, 10, 4, ll=True)
+    assert n_bytes == 4 * cx.tile.TILE_BYTES
+    provider = cx.providers.MapTiler.Streets(key="key")
+    _, n_bytes = cx.estimate_download(-10, -10, 10, 10, 4, ll=True, source=provider)
+    assert n_bytes == 16 * cx.tile.TILE_BYTES
+
+
 @pytest.mark.network
 def test_ll2wdw():
     w, s, e, n = (
@@ -645,6 +683,115 @@ def test_place():
     ax = loc.plot(ax=ax)
     assert_array_almost_equal(loc.bbox_map, ax.images[0].get_extent())
 
+class _FakeGeocoder:
+    """Geocoder returning the same location for any query, counting calls."""
+
+    def __init__(self, domain="fake.example.com"):
+        self.domain = domain
+        self.queries = []
+
+    def geocode(self, query):
+        self.queries.append(query)
+        raw = {"boundingbox": ["40.0", "41.0", "-106.0", "-105.0"]}
+        raw["display_name"] = query
+        return geopy.location.Location(query, (40.5, -105.5, 0.0), raw)
+
+
+def test_place_geocode_cache(tmpdir):
+    url = _write_tile_tree(tmpdir, 3, fill=255)
+    cache = str(tmpdir.join("geocode.sqlite"))
+    geocoder = _FakeGeocoder()
+    with patch("contextily.place._geocode_cache_path", return_value=cache):
+        loc = cx.Place("Boulder", zoom=3, source=url, geocoder=geocoder)
+        again = cx.Place("Boulder", zoom=3, source=url, geocoder=_FakeGeocoder())
+        other = _FakeGeocoder(domain="other.example.com")
+        cx.Place("Boulder", zoom=3, source=url, geocoder=other)
+        cx.Place("Boulder", zoom=3, source=url, geocoder=other, use_cache=False)
+    # the cached result is shared by geocoders of the same service
+    assert geocoder.queries == ["Boulder"]
+    assert other.queries == ["Boulder", "Boulder"]
+    assert again.bbox == loc.bbox == [-106.0, 40.0, -105.0, 41.0]
+    assert (again.latitude, again.longitude) == (40.5, -105.5)
+    assert again.place == "Boulder"
+
+
+def test_place_geocode_cache_location(tmpdir, monkeypatch):
+    import sqlite3
+
+    url = _write_tile_tree(tmpdir, 3, fill=255)
+    # persistent by default, outside of the temporary tile cache
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir.join("xdg")))
+    monkeypatch.setattr("sys.platform", "linux")
+    default = cx.place._geocode_cache_path()
+    assert default == str(tmpdir.join("xdg", "contextily", "geocode.sqlite"))
+    path = str(tmpdir.join("nightly", "geocode.sqlite"))
+    geocoder = _FakeGeocoder()
+    connections = []
+    sqlite_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(sqlite_connect(*args, **kwargs))
+        return connections[-1]
+
+    with patch("contextily.place.sqlite3.connect", side_effect=connect):
+        cx.Place("Boulder", zoom=3, source=url, geocoder=geocoder, geocode_cache=path)
+        cx.Place("Boulder", zoom=3, source=url, geocoder=geocoder, geocode_cache=path)
+    assert geocoder.queries == ["Boulder"]
+    # the connections to the cache are closed
+    assert len(connections) == 3
+    for con in connections:
+        with pytest.raises(sqlite3.ProgrammingError, match="closed"):
+            con.execute("SELECT 1")
+    assert os.path.exists(path) and not os.path.exists(default)
+
+
+def test_place_many(tmpdir):
+    url = _write_tile_tree(tmpdir, 3, fill=255)
+    geocoder = _FakeGeocoder()
+    with patch(
+        "contextily.place._geocode_cache_path",
+        return_value=str(tmpdir.join("geocode.sqlite")),
+    ):
+        places = cx.Place.many(
+            ["Boulder", "Denver", "Boulder"],
+            zoom=3,
+            source=url,
+            geocoder=geocoder,
+            min_delay_seconds=0,
+        )
+    assert geocoder.queries == ["Boulder", "Denver"]
+    assert [place.search for place in places] == ["Boulder", "Denver", "Boulder"]
+    assert places[0] is not places[2]
+    assert all(place.im.shape == (512, 256, 4) for place in places)
+
+
+def test_place_lazy_map(tmpdir):
+    url = _write_tile_tree(tmpdir, 3, fill=255)
+    _write_tile_tree(tmpdir, 2, fill=255)
+    geocoder = _FakeGeocoder()
+    with patch(
+        "contextily.place._geocode_cache_path",
+        return_value=str(tmpdir.join("geocode.sqlite")),
+    ), patch(
+        "contextily.tile._read_local_tile", wraps=cx.tile._read_local_tile
+    ) as read:
+        loc = cx.Place("Boulder", zoom=3, source=url, geocoder=geocoder)
+        # metadata does not need the map
+        assert loc.n_tiles == 2 and loc.latitude == 40.5
+        assert "not loaded" in repr(loc)
+        assert read.call_count == 0
+        assert loc.im.shape == (512, 256, 4)
+        assert read.call_count == 2
+        expected = cx.tile._grid_extent(cx.tile._tile_grid(*loc.bbox, 3))
+        assert_array_almost_equal(loc.bbox_map, expected)
+        # the map can be rendered again at another zoom
+        loc.set_zoom(2)
+        assert loc.zoom == 2 and loc.n_tiles == 1
+        assert loc.im.shape == (256, 256, 4)
+        assert read.call_count == 3
+    assert geocoder.queries == ["Boulder"]
+
+
 # Plotting
 
 
@@ -900,7 +1047,7 @@ def test_add_basemap_warping_local():
     assert ax.get_ylim() == (y1, y2)
 
     assert ax.images[0].get_array()[:, :, :3].sum() == pytest.approx(613344449, rel=0.1)
-    assert ax.images[0].get_array().shape == (980, 862, 4)
+    assert ax.images[0].get_array().shape == (960, 842, 4)
     assert_array_almost_equal(
         ax.images[0].get_array()[:, :, :3].mean(), 242.0192121, decimal=0
     )
@@ -1013,12 +1160,35 @@ def test_attribution():
     matplotlib.pyplot.close(fig)
 
 
-@pytest.mark.network
-def test_set_cache_dir(tmpdir):
-    # set cache directory manually
+def test_attribution_wraps_at_draw_time():
+    fig, ax = matplotlib.pyplot.subplots(1, figsize=(4, 3))
+    with patch.object(
+        matplotlib.figure.Figure, "draw", autospec=True
+    ) as figure_draw:
+        txt = cx.add_attribution(ax, "Test " * 50)
+    # adding the attribution does not render the figure
+    assert not figure_draw.called
+    # the text is wrapped to the width of the axes at the time it is drawn
+    fig.set_size_inches(8, 3)
+    assert txt._get_wrap_line_width() == ax.get_window_extent().width * 0.99
+    fig.canvas.draw()
+    assert txt.get_window_extent().width <= ax.get_window_extent().width
+    matplotlib.pyplot.close(fig)
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    """Set the cache directory to a temporary one for a test, and restore the
+    default afterwards."""
+    monkeypatch.setattr(cx.tile, "_cache_dir", None)
     path = str(tmpdir.mkdir("cache"))
     cx.set_cache_dir(path)
+    return path
+
 
+@pytest.mark.network
+def test_set_cache_dir(cache_dir):
+    # cache directory set manually in the fixture
     # then check that plotting still works
     extent = (-11945319, -10336026, 2910477, 4438236)
     fig, ax = matplotlib.pyplot.subplots()
@@ -1026,6 +1196,13 @@ def test_set_cache_dir(tmpdir):
     cx.add_basemap(ax)
 
 
+def test_set_cache_dir_location(cache_dir):
+    assert cx.tile._get_store().directory == os.path.join(cache_dir, "tiles")
+    # backwards compatible attributes
+    assert cx.tile.memory.location == cache_dir
+    assert cx.tile.tmpdir != cache_dir
+
+
 @pytest.mark.network
 def test_aspect():
     """Test that contextily does not change set aspect"""
@@ -1050,7 +1227,7 @@ def test_aspect():
 def test_merge_tiles_raises_clear_error_for_missing_tile():
     """A tile that failed to download (None) raises a clear ValueError from
     _merge_tiles instead of an AttributeError/TypeError (see GH#252)."""
-    tiles = [mt.Tile(0, 0, 1), mt.Tile(1, 0, 1)]
+    tiles = cx.tile._TileGrid(1, 0, 0, 2, 1)
     valid = np.zeros((256, 256, 4), dtype=np.uint8)
     # the first tile is missing (was AttributeError on arrays[0].shape)
     with pytest.raises(ValueError, match="could not be downloaded"):
@@ -1103,3 +1280,1004 @@ def test_retryer_raises_when_retries_exhausted():
                 max_retries=0,
                 headers={},
             )
+
+
+def _write_tile_tree(root, zoom, fill=None):
+    """Write a complete {z}/{x}/{y}.png tile tree for `zoom` under `root`
+    and return its ``file://`` URL template."""
+    import pathlib
+
+    root = pathlib.Path(root)
+    for x in range(2**zoom):
+        for y in range(2**zoom):
+            value = (x * 2**zoom + y) if fill is None else fill
+            tile = np.full((256, 256, 4), value, dtype=np.uint8)
+            path = root / str(zoom) / str(x) / f"{y}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            Image.fromarray(tile, mode="RGBA").save(path)
+    return root.as_uri() + "/{z}/{x}/{y}.png"
+
+
+def test_bounds2img_local_tiles(tmpdir):
+    url = _write_tile_tree(tmpdir, 1)
+    with patch("contextily.tile.requests.get") as mock_get:
+        img, ext = cx.bounds2img(-179, -80, 179, 80, zoom=1, ll=True, source=url)
+    assert not mock_get.called
+    assert img.shape == (512, 512, 4)
+    # tile (x=1, y=0) lands in the upper right quadrant
+    assert (img[:256, 256:] == 2).all()
+    assert (img[256:, :256] == 1).all()
+    assert_array_almost_equal(
+        ext, (-20037508.342789244, 20037508.342789244) * 2, decimal=3
+    )
+
+    with pytest.raises(FileNotFoundError, match="Tile file does not exist"):
+        cx.bounds2img(-179, -80, 179, 80, zoom=2, ll=True, source=url)
+
+
+def _png_bytes(value):
+    buf = io.BytesIO()
+    tile = np.full((256, 256, 4), value, dtype=np.uint8)
+    Image.fromarray(tile, mode="RGBA").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _tile_response(tile_url, headers=None, timeout=None, value=None):
+    """Mock response of a provider to `tile_url`: a tile filled with `value`,
+    or by default with its index x + y * 2**z."""
+    if value is None:
+        z, x, y = (int(v) for v in tile_url[:-4].split("/")[-3:])
+        value = x + y * 2**z
+    response = MagicMock()
+    response.status_code = 200
+    response.content = _png_bytes(value)
+    return response
+
+
+def _write_mbtiles(path, zoom):
+    import sqlite3
+
+    with sqlite3.connect(path) as con:
+        con.execute("CREATE TABLE metadata (name text, value text)")
+        con.execute(
+            "CREATE TABLE tiles (zoom_level integer, tile_column integer, "
+            "tile_row integer, tile_data blob)"
+        )
+        con.executemany(
+            "INSERT INTO metadata VALUES (?, ?)",
+            [("name", "test"), ("attribution", "MBTiles test"), ("maxzoom", "1")],
+        )
+        for x in range(2**zoom):
+            for y in range(2**zoom):
+                tms_row = 2**zoom - 1 - y
+                con.execute(
+                    "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                    (zoom, x, tms_row, _png_bytes(x * 2**zoom + y)),
+                )
+    con.close()
+
+
+def _write_pmtiles(path, zoom):
+    """Write a minimal PMTiles v3 archive with all tiles behind a single leaf
+    directory."""
+    import struct
+    from contextily.archive import _zxy_to_tileid
+
+    def varints(values):
+        out = bytearray()
+        for value in values:
+            while value >= 0x80:
+                out.append((value & 0x7F) | 0x80)
+                value >>= 7
+            out.append(value)
+        return bytes(out)
+
+    def directory(entries):
+        ids = [e[0] for e in entries]
+        deltas = [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
+        return (
+            varints([len(entries)])
+            + varints(deltas)
+            + varints([e[1] for e in entries])
+            + varints([e[3] for e in entries])
+            + varints([e[2] + 1 for e in entries])
+        )
+
+    tiles = sorted(
+        (_zxy_to_tileid(zoom, x, y), _png_bytes(x * 2**zoom + y))
+        for x in range(2**zoom)
+        for y in range(2**zoom)
+    )
+    data, entries = b"", []
+    for tile_id, content in tiles:
+        entries.append((tile_id, 1, len(data), len(content)))
+        data += content
+    leaf = directory(entries)
+    root = directory([(tiles[0][0], 0, 0, len(leaf))])
+    metadata = b'{"attribution": "PMTiles test"}'
+    offsets = [127, len(root), 127 + len(root), len(metadata)]
+    offsets += [offsets[2] + len(metadata), len(leaf)]
+    offsets += [offsets[4] + len(leaf), len(data)]
+    header = struct.pack(
+        "<7sBQQQQQQQQQQQBBBBBBiiiiBii",
+        b"PMTiles", 3, *offsets, len(tiles), len(tiles), len(tiles),
+        1, 1, 1, 2, 0, zoom, -1800000000, -850000000, 1800000000, 850000000,
+        0, 0, 0,
+    )
+    with open(path, "wb") as f:
+        f.write(header + root + metadata + leaf + data)
+
+
+@pytest.mark.parametrize("ext", [".mbtiles", ".pmtiles"])
+def test_bounds2img_archive(tmpdir, ext):
+    path = str(tmpdir.join("tiles" + ext))
+    writer = _write_mbtiles if ext == ".mbtiles" else _write_pmtiles
+    writer(path, 1)
+    with patch("contextily.tile.requests.get") as mock_get:
+        img, ext = cx.bounds2img(-179, -80, 179, 80, zoom=1, ll=True, source=path)
+    assert not mock_get.called
+    assert img.shape == (512, 512, 4)
+    assert (img[:256, 256:] == 2).all()
+    assert (img[256:, :256] == 1).all()
+    assert (img[256:, 256:] == 3).all()
+
+    # zoom levels missing from the archive raise an informative error
+    with pytest.raises(ValueError, match="not valid|not available"):
+        cx.bounds2img(-179, -80, 179, 80, zoom=2, ll=True, source=path)
+
+    # the attribution stored in the archive is used by add_basemap
+    fig, ax = matplotlib.pyplot.subplots()
+    ax.axis((-1e7, 1e7, -1e7, 1e7))
+    cx.add_basemap(ax, source=path, zoom=1)
+    assert ax.images[0].get_array().shape == (512, 512, 4)
+    assert ax.texts[0].get_text().endswith("test")
+    matplotlib.pyplot.close(fig)
+
+
+def test_import_is_lazy():
+    """`import contextily` and `howmany` do not load the heavy dependencies
+    nor create the tile cache directory."""
+    import subprocess
+    import sys
+
+    code = (
+        "import sys\n"
+        "import contextily as cx\n"
+        "cx.howmany(-10, -10, 10, 10, 5, verbose=False, ll=True)\n"
+        "heavy = ['matplotlib', 'rasterio', 'PIL', 'joblib', 'requests', 'geopy', "
+        "'xyzservices']\n"
+        "print([m for m in heavy if m in sys.modules])\n"
+        "print(cx.tile._tmpdir)\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.split("\n")
+    assert out[0] == "[]"
+    assert out[1] == "None"
+
+    # lazily loaded attributes resolve to the actual objects
+    from contextily.tile import bounds2img
+
+    assert cx.bounds2img is bounds2img
+    assert "add_basemap" in dir(cx)
+    with pytest.raises(AttributeError):
+        cx.not_an_attribute
+
+
+def test_tile_grid():
+    from contextily.tile import _tile_grid, _grid_xy, _grid_extent, _build_urls
+
+    w, s, e, n = (
+        2.5135730322461427,
+        49.529483547557504,
+        6.15665815595878,
+        51.47502370869813,
+    )
+    grid = _tile_grid(w, s, e, n, 7)
+    xs, ys = _grid_xy(grid)
+    assert set(zip(xs.tolist(), ys.tolist())) == {
+        (t.x, t.y) for t in mt.tiles(w, s, e, n, [7])
+    }
+    assert_array_almost_equal(
+        _grid_extent(grid),
+        (0.0, 939258.2035682457, 6261721.35712164, 6887893.492833804),
+    )
+    urls = _build_urls(cx.providers.OpenStreetMap.Mapnik, grid.z, xs, ys)
+    assert urls[0] == "https://tile.openstreetmap.org/7/64/42.png"
+    assert urls[-1] == "https://tile.openstreetmap.org/7/66/43.png"
+
+
+def test_bounds2img_antimeridian(tmpdir):
+    url = _write_tile_tree(tmpdir, 2)
+    # crossing given as w > e, only the two columns next to the seam are read
+    assert cx.howmany(170, -10, -170, 10, 2, verbose=False, ll=True) == 4
+    img, ext = cx.bounds2img(170, -10, -170, 10, zoom=2, ll=True, source=url)
+    assert img.shape == (512, 512, 4)
+    # last column (x=3) on the left, first column (x=0) on the right
+    assert (img[:256, :256] == 3 * 4 + 1).all()
+    assert (img[:256, 256:] == 0 * 4 + 1).all()
+    quarter = 10018754.171394622
+    assert_array_almost_equal(ext, (quarter, 3 * quarter, -quarter, quarter))
+
+    # same crossing given in continuous coordinates beyond 180 degrees
+    img2, ext2 = cx.bounds2img(19e6, -1e6, 21e6, 1e6, zoom=2, source=url)
+    np.testing.assert_array_equal(img, img2)
+    assert_array_almost_equal(ext, ext2)
+    img3, ext3 = cx.bounds2img(-21e6, -1e6, -19e6, 1e6, zoom=2, source=url)
+    np.testing.assert_array_equal(img, img3)
+    assert_array_almost_equal(ext3, (-3 * quarter, -quarter, -quarter, quarter))
+
+    # auto zoom uses the width across the antimeridian
+    assert _calculate_zoom(170, -10, -170, 10) == _calculate_zoom(-10, -10, 10, 10)
+
+
+def test_world_extent_with_margins(tmpdir):
+    url = _write_tile_tree(tmpdir, 2)
+    world = cx.tile._ORIGIN_SHIFT
+    expected, expected_ext = cx.bounds2img(
+        -world, -1e7, world, 1e7, zoom=2, source=url
+    )
+    # a view wider than the world is not an antimeridian crossing
+    img, ext = cx.bounds2img(-1.1 * world, -1e7, 1.1 * world, 1e7, zoom=2, source=url)
+    np.testing.assert_array_equal(img, expected)
+    assert_array_almost_equal(ext, (-world, world, *expected_ext[2:]))
+
+    fig, ax = matplotlib.pyplot.subplots()
+    ax.plot([-world, world], [-1e7, 1e7])
+    ax.margins(0.05)
+    cx.add_basemap(ax, source=url, zoom=2)
+    assert_array_almost_equal(ax.images[0].get_extent()[:2], (-world, world))
+    matplotlib.pyplot.close(fig)
+
+
+def test_bounds2img_overzoom(tmpdir):
+    from xyzservices import TileProvider
+
+    url = _write_tile_tree(tmpdir, 1)
+    provider = TileProvider(url=url, name="local", attribution="", max_zoom=1)
+    w, s, e, n = 10, 10, 30, 30
+    with pytest.raises(ValueError, match="not valid"):
+        cx.bounds2img(w, s, e, n, zoom=3, ll=True, source=provider)
+
+    # only the zoom 1 tree exists, so zoom 3 is served from it
+    img, ext = cx.bounds2img(
+        w, s, e, n, zoom=3, ll=True, source=provider, overzoom=True
+    )
+    expected_grid = cx.tile._tile_grid(w, s, e, n, 3)
+    assert img.shape == (256 * expected_grid.n_y, 256 * expected_grid.n_x, 4)
+    assert_array_almost_equal(ext, cx.tile._grid_extent(expected_grid))
+    # the area lies within tile (x=1, y=0) at zoom 1
+    assert (img[:, :, 3] == 2).all()
+
+    # automatically chosen zooms are upsampled instead of clipped
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        img, ext = cx.bounds2img(w, s, e, n, ll=True, source=provider, overzoom=True)
+    assert img.shape[0] > 256
+
+
+def test_bounds2img_pyramid_levels():
+    url = "https://example.com/pyramid/{z}/{x}/{y}.png"
+
+    w, s, e, n = -170, -80, 170, 80
+    with patch("contextily.tile.requests.get", side_effect=_tile_response):
+        fine, _ = cx.bounds2img(w, s, e, n, zoom=2, ll=True, source=url)
+
+    with patch("contextily.tile.requests.get") as mock_get:
+        # opt-in only
+        mock_get.side_effect = requests.ConnectionError
+        with pytest.raises(requests.ConnectionError):
+            cx.bounds2img(w, s, e, n, zoom=1, ll=True, source=url)
+        coarse, ext = cx.bounds2img(
+            w, s, e, n, zoom=1, ll=True, source=url, pyramid_levels=2
+        )
+        # the tiles built were cached, and are reused without their children
+        with patch("contextily.tile._from_cached_children") as build:
+            again, _ = cx.bounds2img(
+                w, s, e, n, zoom=1, ll=True, source=url, pyramid_levels=2
+            )
+        assert not build.called
+        # zoom 0 is built from the 16 cached zoom 2 tiles
+        world, _ = cx.bounds2img(
+            w, s, e, n, zoom=0, ll=True, source=url, pyramid_levels=2
+        )
+    assert coarse.shape == (512, 512, 4)
+    np.testing.assert_array_equal(coarse, cx.tile._reduce_image(fine, 2))
+    np.testing.assert_array_equal(again, coarse)
+    # tile (0, 0) at zoom 1 is made of the children with values 0, 1, 4 and 5
+    assert (coarse[128:256, 128:256, 3] == 5).all()
+    assert world.shape == (256, 256, 4)
+    np.testing.assert_array_equal(world, cx.tile._reduce_image(fine, 4))
+
+
+def test_bounds2img_budget(tmpdir):
+    url = _write_tile_tree(tmpdir, 0)
+    w, s, e, n = -170, -80, 170, 80
+    # the zoom 2 plan (16 tiles) is stepped down to zoom 0, where tiles exist
+    with pytest.warns(UserWarning, match="reduced to 0"):
+        img, _ = cx.bounds2img(w, s, e, n, zoom=2, ll=True, source=url, max_tiles=3)
+    assert img.shape == (256, 256, 4)
+    with pytest.warns(UserWarning, match="reduced to 0"):
+        img, _ = cx.bounds2img(
+            w, s, e, n, zoom=2, ll=True, source=url, max_bytes=256 * 256 * 4
+        )
+    assert img.shape == (256, 256, 4)
+
+    # nothing is downloaded when the budget is exceeded
+    web = "https://example.com/{z}/{x}/{y}.png"
+    with patch("contextily.tile.requests.get") as mock_get:
+        with pytest.raises(ValueError, match="16 tiles"):
+            cx.bounds2img(
+                w, s, e, n, zoom=2, ll=True, source=web, max_tiles=10,
+                budget_action="raise",
+            )
+        with pytest.raises(ValueError, match="exceeding the budget"):
+            cx.bounds2img(w, s, e, n, zoom=2, ll=True, source=web, max_bytes=1000)
+    mock_get.assert_not_called()
+
+
+def test_calculate_display_zoom():
+    from contextily.tile import _calculate_display_zoom
+
+    # one tile at zoom 10
+    w, s, e, n = -105.46875, 40.17887331434696, -105.1171875, 40.44694705960048
+    assert _calculate_display_zoom(w, s, e, n, (256, 256)) == 10
+    assert _calculate_display_zoom(w, s, e, n, (257, 200)) == 11
+    assert _calculate_display_zoom(w, s, e, n, (64, 64)) == 8
+    assert _calculate_display_zoom(w, s, e, n, (256, 256), tile_size=512) == 9
+
+
+def test_add_basemap_display_zoom(tmpdir):
+    url = _write_tile_tree(tmpdir, 1, fill=255)
+    _write_tile_tree(tmpdir, 2, fill=255)
+    extent = (-1.5e7, 1.5e7, -1.5e7, 1.5e7)
+
+    # a small figure only needs zoom 1 ...
+    fig, ax = matplotlib.pyplot.subplots(figsize=(4, 4), dpi=100)
+    ax.axis(extent)
+    cx.add_basemap(ax, source=url, attribution=False)
+    assert ax.images[0].get_array().shape == (512, 512, 4)
+    matplotlib.pyplot.close(fig)
+
+    # ... while the same extent on a larger (or denser) figure needs zoom 2
+    fig, ax = matplotlib.pyplot.subplots(figsize=(4, 4), dpi=200)
+    ax.axis(extent)
+    cx.add_basemap(ax, source=url, attribution=False)
+    assert ax.images[0].get_array().shape == (1024, 1024, 4)
+    matplotlib.pyplot.close(fig)
+
+
+def test_add_basemap_display_zoom_equal_aspect(tmpdir):
+    from contextily.plotting import _axes_pixel_shape
+
+    url = _write_tile_tree(tmpdir, 2)
+    extent = (-1e7, 1e7, -1e7, 1e7)
+    fig, ax = matplotlib.pyplot.subplots()
+    ax.axis(extent)
+    ax.set_aspect("equal")
+    # measured as drawn, square, not as the wider box before the draw
+    height, width = _axes_pixel_shape(ax)
+    assert width == pytest.approx(height)
+    cx.add_basemap(ax, source=url, zoom=2, downsample=1, attribution=False)
+    fig.canvas.draw()
+    assert _axes_pixel_shape(ax) == (height, width)
+    # reduced to the rendered size
+    left, right = ax.images[0].get_extent()[:2]
+    expected = np.ceil(width * (right - left) / (extent[1] - extent[0]))
+    assert ax.images[0].get_array().shape[1] == expected
+    matplotlib.pyplot.close(fig)
+
+
+def test_add_basemap_interactive(tmpdir):
+    url = _write_tile_tree(tmpdir, 2)
+    fig, ax = matplotlib.pyplot.subplots()
+    ax.axis((-1.9e7, -0.1e7, 0.1e7, 1.9e7))
+    cx.add_basemap(ax, source=url, zoom=2, attribution=False, interactive=True)
+    im = ax.images[0]
+    assert im.get_array().shape == (512, 512, 4)
+
+    # panning east only reads the newly exposed column of tiles
+    with patch(
+        "contextily.tile._read_local_tile", wraps=cx.tile._read_local_tile
+    ) as read:
+        ax.set_xlim(-0.9e7, 0.9e7)
+    assert sorted(call.args[0][-9:] for call in read.call_args_list) == [
+        "2/2/0.png",
+        "2/2/1.png",
+    ]
+    assert len(ax.images) == 1
+    assert ax.get_xlim() == (-0.9e7, 0.9e7)
+    xmin, xmax, _, _ = im.get_extent()
+    assert xmin < -0.9e7 and xmax > 0.9e7
+    # tile (x=2, y=0) is now in the upper right quadrant
+    assert (im.get_array()[:256, 256:, 3] == 8).all()
+    matplotlib.pyplot.close(fig)
+
+
+def test_add_basemap_lazy(tmpdir):
+    import io
+
+    url = _write_tile_tree(tmpdir, 1, fill=255)
+    _write_tile_tree(tmpdir, 2, fill=255)
+    fig, ax = matplotlib.pyplot.subplots(figsize=(4, 4), dpi=100)
+    ax.axis((-1.5e7, 1.5e7, -1.5e7, 1.5e7))
+    with patch(
+        "contextily.tile._read_local_tile", wraps=cx.tile._read_local_tile
+    ) as read:
+        artist = cx.add_basemap(ax, source=url, attribution=False, lazy=True)
+        assert isinstance(artist, cx.BasemapArtist)
+        assert list(ax.images) == [artist]
+        # nothing is fetched until the figure is rendered
+        assert read.call_count == 0
+        fig.savefig(io.BytesIO(), dpi=100)
+        assert read.call_count == 4
+        assert artist.get_array().shape == (512, 512, 4)
+        # rendering again reuses the mosaic of the same zoom ...
+        fig.savefig(io.BytesIO(), dpi=100)
+        assert read.call_count == 4
+        # ... while a higher DPI needs a higher zoom
+        fig.savefig(io.BytesIO(), dpi=200)
+        assert read.call_count == 4 + 16
+        assert artist.get_array().shape == (1024, 1024, 4)
+        fig.savefig(io.BytesIO(), dpi=100)
+        assert read.call_count == 4 + 16
+    assert sorted(artist.mosaics) == [1, 2]
+    assert ax.axis() == (-1.5e7, 1.5e7, -1.5e7, 1.5e7)
+    matplotlib.pyplot.close(fig)
+
+
+def test_add_basemap_downsample(tmpdir):
+    url = _write_tile_tree(tmpdir, 2)
+    world = 20037508.342789244
+    fig, ax = matplotlib.pyplot.subplots(figsize=(4, 4), dpi=50)
+    ax.axis((-world, world, -world, world))
+    cx.add_basemap(ax, source=url, zoom=2, attribution=False, downsample=1)
+    bbox = ax.get_window_extent()
+    image = ax.images[0].get_array()
+    assert image.shape == (np.ceil(bbox.height), np.ceil(bbox.width), 4)
+    # each quarter of the image is the area average of a single tile
+    assert image[0, 0, 3] == 0 and image[-1, -1, 3] == 15
+    assert_array_almost_equal(
+        ax.images[0].get_extent(), (-world, world, -world, world)
+    )
+
+    # an image already coarser than the display is left as is
+    cx.add_basemap(ax, source=url, zoom=2, attribution=False, downsample=10)
+    assert ax.images[1].get_array().shape == (1024, 1024, 4)
+    matplotlib.pyplot.close(fig)
+
+
+def test_add_basemap_downsample_local(tmpdir):
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_origin
+
+    path = str(tmpdir.join("big.tif"))
+    data = np.repeat(np.arange(2000, dtype=np.uint16)[None, :], 2000, axis=0)
+    with rio.open(
+        path, "w", driver="GTiff", height=2000, width=2000, count=1,
+        dtype="uint16", crs="epsg:3857", transform=from_origin(0, 2000, 1, 1),
+    ) as dst:
+        dst.write(data, 1)
+        dst.build_overviews([2, 4, 8], Resampling.average)
+
+    fig, ax = matplotlib.pyplot.subplots(figsize=(4, 4), dpi=50)
+    ax.axis((0, 2000, 0, 2000))
+    cx.add_basemap(ax, source=path, downsample=1)
+    bbox = ax.get_window_extent()
+    image = ax.images[0].get_array()
+    assert image.shape == (np.ceil(bbox.height), np.ceil(bbox.width))
+    assert_array_almost_equal(ax.images[0].get_extent(), (0, 2000, 0, 2000))
+    # columns are averaged, up to the resolution of the overview used
+    assert abs(image[0].mean() - data.mean()) < 10
+
+    # only the window in view is read, at the display resolution
+    ax.axis((500, 1000, 500, 1000))
+    cx.add_basemap(ax, source=path, downsample=1)
+    image = ax.images[1].get_array()
+    assert image.shape == (np.ceil(bbox.height), np.ceil(bbox.width))
+    assert_array_almost_equal(ax.images[1].get_extent(), (500, 1000, 500, 1000))
+    assert 500 <= image.min() and image.max() < 1000
+    matplotlib.pyplot.close(fig)
+
+
+def test_add_basemap_warping_local_window(tmpdir):
+    from rasterio.transform import from_bounds
+    from rasterio.warp import transform_bounds
+
+    # raster in Web Mercator covering more than the view
+    path = str(tmpdir.join("wm.tif"))
+    bounds = transform_bounds("epsg:4326", "epsg:3857", -107, 38, -104, 41)
+    with rio.open(
+        path, "w", driver="GTiff", height=300, width=300, count=1, dtype="uint8",
+        crs="epsg:3857", transform=from_bounds(*bounds, 300, 300),
+    ) as dst:
+        dst.write(np.full((300, 300), 200, dtype=np.uint8), 1)
+
+    fig, ax = matplotlib.pyplot.subplots()
+    ax.axis((-105.5, -105.0, 39.56, 40.13))
+    cx.add_basemap(ax, source=path, crs="epsg:4326", attribution=False)
+    image = ax.images[0].get_array()
+    west, east, south, north = ax.images[0].get_extent()
+    # only the view is warped, at the resolution of the raster
+    assert west <= -105.5 < west + 0.02 and east - 0.02 < -105.0 <= east
+    assert south <= 39.56 < south + 0.02 and north - 0.02 < 40.13 <= north
+    assert image.shape[1] == pytest.approx(300 / 6, abs=2)
+    assert (image == 200).all()
+    matplotlib.pyplot.close(fig)
+
+
+def test_bounds2img_chunks(tmpdir):
+    pytest.importorskip("dask")
+    xr = pytest.importorskip("xarray")
+
+    url = _write_tile_tree(tmpdir, 2)
+    w, s, e, n = -170, -80, 170, 80
+    expected, expected_ext = cx.bounds2img(w, s, e, n, zoom=2, ll=True, source=url)
+    with patch(
+        "contextily.tile._read_local_tile", wraps=cx.tile._read_local_tile
+    ) as read:
+        img, ext = cx.bounds2img(w, s, e, n, zoom=2, ll=True, source=url, chunks=2)
+        assert isinstance(img, xr.DataArray)
+        assert img.shape == expected.shape
+        assert img.data.chunks[:2] == ((512, 512), (512, 512))
+        # nothing is fetched until a region is computed
+        assert read.call_count == 0
+        corner = img[:256, :256].values
+        assert read.call_count == 4
+    np.testing.assert_array_equal(corner, expected[:256, :256])
+    np.testing.assert_array_equal(img.values, expected)
+    assert ext == expected_ext
+    assert img.x[0] > ext[0] and img.y[0] < ext[3]
+    assert img.attrs["transform"][2] == ext[0]
+
+
+@pytest.fixture
+def tile_server(tmpdir):
+    """Serve a zoom 2 tile tree over HTTP on localhost, return its URL."""
+    import functools
+    import http.server
+    import threading
+
+    _write_tile_tree(tmpdir, 2)
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(Handler, directory=str(tmpdir))
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}.png".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_bounds2img_processes_shared_memory(tile_server):
+    import joblib
+
+    w, s, e, n = -170, -80, 170, 80
+    expected, expected_ext = cx.bounds2img(
+        w, s, e, n, zoom=2, ll=True, source=tile_server, use_cache=False
+    )
+    # processes are only used if configured with joblib
+    with joblib.parallel_config(backend="loky"), patch(
+        "contextily.tile._merge_tiles", wraps=cx.tile._merge_tiles
+    ) as merge:
+        img, ext = cx.bounds2img(
+            w, s, e, n, zoom=2, ll=True, source=tile_server, n_connections=2
+        )
+    # the workers wrote the tiles in place, no merge was needed
+    assert not merge.called
+    np.testing.assert_array_equal(img, expected)
+    assert ext == expected_ext
+
+
+def test_bounds2img_memory_store_processes(tile_server):
+    import joblib
+    import pickle
+
+    store = cx.MemoryTileStore()
+    with pytest.raises(TypeError):
+        pickle.dumps(store)
+    w, s, e, n = -170, -80, 170, 80
+    # the tiles are downloaded with threads, into the store of this process
+    with joblib.parallel_config(backend="loky"), patch(
+        "contextily.tile._fetch_mosaic_shared"
+    ) as shared:
+        cx.bounds2img(
+            w, s, e, n, zoom=2, ll=True, source=tile_server, n_connections=2,
+            store=store,
+        )
+    assert not shared.called
+    urls = [tile_server.format(z=2, x=x, y=y) for x in range(4) for y in range(4)]
+    assert None not in store.bulk_get(urls)
+
+
+def test_bounds2img_cached_threads(tile_server, cache_dir):
+    w, s, e, n = -170, -80, 170, 80
+    expected, _ = cx.bounds2img(
+        w, s, e, n, zoom=2, ll=True, source=tile_server, use_cache=False
+    )
+    with patch("contextily.tile._fetch_mosaic_shared") as shared, patch(
+        "contextily.tile._download_tile", wraps=cx.tile._download_tile
+    ) as download:
+        img, _ = cx.bounds2img(
+            w, s, e, n, zoom=2, ll=True, source=tile_server, n_connections=4
+        )
+        assert download.call_count == 16
+        # the second time, all tiles are read from the cache
+        cached, _ = cx.bounds2img(
+            w, s, e, n, zoom=2, ll=True, source=tile_server, n_connections=4
+        )
+        assert download.call_count == 16
+    assert not shared.called
+    np.testing.assert_array_equal(img, expected)
+    np.testing.assert_array_equal(cached, expected)
+    assert cx.tile._get_store().directory.startswith(cache_dir)
+
+
+@pytest.mark.parametrize("kind", ["memory", "file", "sqlite"])
+def test_tile_store_concurrent(tmpdir, kind):
+    from concurrent.futures import ThreadPoolExecutor
+
+    if kind == "memory":
+        store = cx.MemoryTileStore()
+    elif kind == "file":
+        store = cx.FileTileStore(str(tmpdir.join("tiles")))
+    else:
+        store = cx.SQLiteTileStore(str(tmpdir.join("tiles.sqlite")))
+    assert store.get("a") is None
+    assert not store.contains("a")
+    contents = [bytes([i]) * 10000 for i in range(8)]
+
+    def write_and_read(content):
+        store.put("a", content)
+        return store.get("a")
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(write_and_read, contents * 8))
+    # concurrent writes to the same key never expose partial content
+    assert all(result in contents for result in results)
+    assert store.contains("a")
+    store.put("b", b"tile")
+    assert store.bulk_get(["b", "c", "a"])[:2] == [b"tile", None]
+    store.delete("a")
+    store.delete("c")
+    assert not store.contains("a")
+    assert store.bulk_get(["a", "b"]) == [None, b"tile"]
+    if kind == "file":
+        assert not [f for f in tmpdir.join("tiles").visit() if f.ext == ".tmp"]
+
+
+def test_memory_tile_store_bounded():
+    store = cx.MemoryTileStore(max_bytes=25)
+    for key in "abc":
+        store.put(key, b"x" * 10)
+    # the least recently used tile was dropped
+    assert store.bulk_get("abc") == [None, b"x" * 10, b"x" * 10]
+    store.get("b")
+    store.put("d", b"x" * 10)
+    assert not store.contains("c") and store.contains("b")
+
+
+def test_bounds2img_custom_store(tmpdir):
+    url = "https://example.com/store/{z}/{x}/{y}.png"
+
+    class DictStore(cx.TileStore):
+        """Stand-in for e.g. an object store"""
+
+        def __init__(self):
+            self.tiles = {}
+
+        def get(self, key):
+            return self.tiles.get(key)
+
+        def put(self, key, content):
+            self.tiles[key] = content
+
+        def delete(self, key):
+            self.tiles.pop(key, None)
+
+    store = DictStore()
+    w, s, e, n = -170, -80, 170, 80
+    with patch("contextily.tile.requests.get", side_effect=_tile_response) as get:
+        img, ext = cx.bounds2img(
+            w, s, e, n, zoom=1, ll=True, source=url, store=store
+        )
+        assert get.call_count == 4
+        assert sorted(store.tiles) == sorted(
+            url.format(z=1, x=x, y=y) for x in range(2) for y in range(2)
+        )
+        # the tiles come from the store, not from the default cache
+        assert not cx.tile._get_store().contains(url.format(z=1, x=0, y=0))
+        fig, ax = matplotlib.pyplot.subplots()
+        ax.axis(ext)
+        cx.add_basemap(ax, source=url, zoom=1, store=store)
+        assert get.call_count == 4
+        path = str(tmpdir.join("store.tif"))
+        cx.bounds2raster(w, s, e, n, path, zoom=1, ll=True, source=url, store=store)
+        assert get.call_count == 4
+    np.testing.assert_array_equal(ax.images[0].get_array(), img)
+    matplotlib.pyplot.close(fig)
+
+
+def test_bounds2img_coalesces_in_flight_tiles():
+    import threading
+    import time
+
+    url = "https://example.com/burst/{z}/{x}/{y}.png"
+    lock = threading.Lock()
+    requested = []
+
+    def respond(tile_url, headers, timeout):
+        with lock:
+            requested.append(tile_url)
+        time.sleep(0.2)
+        return _tile_response(tile_url, value=1)
+
+    w, s, e, n = -170, -80, 170, 80
+    results = []
+
+    def render():
+        results.append(
+            cx.bounds2img(w, s, e, n, zoom=1, ll=True, source=url, use_cache=False)
+        )
+
+    with patch("contextily.tile.requests.get", side_effect=respond):
+        threads = [threading.Thread(target=render) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # each tile went to the provider once, though three views needed it
+    assert sorted(requested) == sorted(set(requested))
+    assert len(requested) == 4
+    assert len(results) == 3
+    for img, _ in results:
+        np.testing.assert_array_equal(img, results[0][0])
+    assert cx.tile._in_flight == {}
+
+
+def test_proxy_and_direct_fetches_in_flight():
+    import threading
+    import time
+
+    from contextily.server import TileProxy
+
+    url = "https://example.com/shared/{z}/{x}/{y}.png"
+
+    def respond(tile_url, headers, timeout):
+        time.sleep(0.2)
+        return _tile_response(tile_url, value=7)
+
+    proxy = TileProxy(url, store=cx.MemoryTileStore())
+    results = {}
+
+    def from_proxy():
+        results["proxy"] = proxy.get_tile(1, 0, 0)
+
+    def direct():
+        results["direct"] = cx.tile._fetch_tile(url.format(z=1, x=0, y=0), 0, 0, {})
+
+    with patch("contextily.tile.requests.get", side_effect=respond), patch.object(
+        proxy.session, "get", side_effect=respond
+    ):
+        threads = [threading.Thread(target=f) for f in (from_proxy, direct)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    # the same tile downloaded at the same time, each gets its own kind
+    assert results["proxy"] == _png_bytes(7)
+    assert isinstance(results["direct"], np.ndarray)
+    assert (results["direct"] == 7).all()
+    assert cx.tile._in_flight == {}
+
+
+def test_tile_proxy_server(tile_server, cache_dir):
+    import threading
+
+    from contextily.server import make_server
+
+    server = make_server(tile_server, port=0, max_rate=1000)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    proxy = "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}.png".format(
+        server.server_address[1]
+    )
+    w, s, e, n = -170, -80, 170, 80
+    try:
+        expected, expected_ext = cx.bounds2img(
+            w, s, e, n, zoom=2, ll=True, source=tile_server, use_cache=False
+        )
+        with patch(
+            "contextily.server._download_tile", wraps=cx.tile._download_tile
+        ) as upstream:
+            for _ in range(2):
+                img, ext = cx.bounds2img(
+                    w, s, e, n, zoom=2, ll=True, source=proxy, use_cache=False,
+                    n_connections=4,
+                )
+                np.testing.assert_array_equal(img, expected)
+                assert ext == expected_ext
+        # the second round was served from the cache of the proxy
+        assert upstream.call_count == 16
+        # errors of the provider are passed on
+        response = requests.get(proxy.format(z=3, x=0, y=0))
+        assert response.status_code == 404
+        response = requests.get(proxy.format(z=2, x=0, y=0))
+        assert response.headers["Content-Type"] == "image/png"
+        assert requests.get(proxy.format(z=1, x=5, y=0)).status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("kind", ["mbtiles", "file"])
+def test_tile_proxy_server_local_sources(tmpdir, kind):
+    import threading
+
+    from contextily.server import make_server
+
+    if kind == "mbtiles":
+        source = str(tmpdir.join("tiles.mbtiles"))
+        _write_mbtiles(source, 1)
+    else:
+        source = _write_tile_tree(tmpdir, 1)
+    server = make_server(source, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    proxy = "http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}.png".format(
+        server.server_address[1]
+    )
+    w, s, e, n = -179, -80, 179, 80
+    try:
+        expected, _ = cx.bounds2img(w, s, e, n, zoom=1, ll=True, source=source)
+        img, _ = cx.bounds2img(
+            w, s, e, n, zoom=1, ll=True, source=proxy, use_cache=False
+        )
+        np.testing.assert_array_equal(img, expected)
+        # tiles missing from the source are not found
+        assert requests.get(proxy.format(z=2, x=0, y=0)).status_code == 404
+        # nor are tiles of another resolution
+        retina = proxy.replace(".png", "@2x.png").format(z=1, x=0, y=0)
+        assert requests.get(retina).status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_bounds2img_decoded_cache(tmpdir):
+    import pickle
+
+    url = "https://example.com/decoded/{z}/{x}/{y}.png"
+
+    path = str(tmpdir.join("decoded.bin"))
+    decoded = cx.DecodedTileCache(path, capacity=8)
+    store = cx.MemoryTileStore()
+    w, s, e, n = -170, -80, 170, 80
+    with patch("contextily.tile.requests.get", side_effect=_tile_response):
+        expected, expected_ext = cx.bounds2img(
+            w, s, e, n, zoom=1, ll=True, source=url, store=store
+        )
+        img, ext = cx.bounds2img(
+            w, s, e, n, zoom=1, ll=True, source=url, store=store,
+            decoded_cache=decoded,
+        )
+    np.testing.assert_array_equal(img, expected)
+    assert ext == expected_ext
+    # warm reads neither read nor decode the tiles, also from another
+    # instance (e.g. in another process)
+    other = pickle.loads(pickle.dumps(decoded))
+    with patch("contextily.tile._decode_tile") as decode, patch.object(
+        store, "bulk_get"
+    ) as bulk_get:
+        img, _ = cx.bounds2img(
+            w, s, e, n, zoom=1, ll=True, source=url, store=store,
+            decoded_cache=other,
+        )
+    assert not decode.called and not bulk_get.called
+    np.testing.assert_array_equal(img, expected)
+    # the file is bounded, and rebuilt if the layout changes
+    size = os.path.getsize(path)
+    for i in range(20):
+        decoded.put(str(i), np.full((256, 256, 4), i, dtype=np.uint8))
+    assert os.path.getsize(path) == size
+    assert decoded.get("19")[0, 0, 0] == 19
+    assert sum(decoded.get(str(i)) is not None for i in range(20)) <= 8
+    assert not decoded.put("odd", np.zeros((512, 512, 4), dtype=np.uint8))
+    assert cx.DecodedTileCache(path, capacity=16).get("19") is None
+
+
+def test_tile_proxy_rate_limits_retries():
+    from contextily.server import TileProxy
+
+    failed = MagicMock()
+    failed.status_code = 429
+    failed.raise_for_status.side_effect = requests.HTTPError
+    ok = MagicMock()
+    ok.status_code = 200
+    ok.content = _png_bytes(1)
+    proxy = TileProxy(
+        "https://example.com/limited/{z}/{x}/{y}.png",
+        max_rate=1000,
+        store=cx.MemoryTileStore(),
+    )
+    with patch.object(
+        proxy.session, "get", side_effect=[failed, failed, ok]
+    ) as get, patch.object(proxy._limiter, "wait") as wait:
+        assert proxy.get_tile(1, 0, 0) == ok.content
+    # the retries are spaced by the rate limiter too
+    assert get.call_count == 3
+    assert wait.call_count == 3
+
+
+def test_tile_proxy_passes_content_through():
+    from contextily.server import TileProxy
+
+    ok = MagicMock()
+    ok.status_code = 200
+    # e.g. a vector tile, that PIL cannot read
+    ok.content = b"\x1a\x03pbf"
+    proxy = TileProxy(
+        "https://example.com/raw/{z}/{x}/{y}.pbf", store=cx.MemoryTileStore()
+    )
+    with patch.object(proxy.session, "get", return_value=ok) as get, patch(
+        "contextily.tile._decode_tile"
+    ) as decode:
+        assert proxy.get_tile(1, 0, 0) == ok.content
+    assert get.call_count == 1
+    assert not decode.called
+
+    # content that is not an image is still retried when decoding
+    with patch("contextily.tile.requests.get", return_value=ok) as get:
+        with pytest.raises(requests.HTTPError, match="not an image"):
+            _retryer("https://example.com/raw/1/0/0.pbf", 0, 2, {})
+    assert get.call_count == 3
+
+
+def test_fetch_tile_rechecks_store_before_downloading():
+    class LateStore(cx.MemoryTileStore):
+        """The first lookup misses a tile stored meanwhile by another thread"""
+
+        def __init__(self):
+            super().__init__()
+            self.lookups = 0
+
+        def get(self, key):
+            self.lookups += 1
+            return None if self.lookups == 1 else super().get(key)
+
+    url = "https://example.com/late/1/0/0.png"
+    store = LateStore()
+    store.put(url, _png_bytes(7))
+    with patch("contextily.tile.requests.get") as get:
+        array = cx.tile._fetch_tile(url, 0, 0, {}, store=store)
+    assert not get.called
+    assert (array == 7).all()
+
+
+def test_mbtiles_closes_connections(tmpdir):
+    import sqlite3
+
+    from contextily.archive import MBTiles
+
+    path = str(tmpdir.join("closed.mbtiles"))
+    _write_mbtiles(path, 1)
+    connections = []
+    sqlite_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(sqlite_connect(*args, **kwargs))
+        return connections[-1]
+
+    with patch("contextily.archive.sqlite3.connect", side_effect=connect):
+        reader = MBTiles(path)
+        tiles = reader.read_tiles(1, [0, 1], [0, 1])
+    assert all(tile is not None for tile in tiles)
+    assert len(connections) == 2
+    for con in connections:
+        with pytest.raises(sqlite3.ProgrammingError, match="closed"):
+            con.execute("SELECT 1")